@@ -43,10 +43,474 @@
 
 '''
 
-import smbus                # import the i2c library
+try:
+    import smbus2 as smbus          # import the i2c library (smbus2 can also combine writes into one transaction)
+    from smbus2 import i2c_msg
+except ImportError:
+    i2c_msg = None
+    try:
+        import smbus                # fall back to the original smbus library (no combined transactions)
+    except ImportError:
+        smbus = None                # no i2c library, only other bus backends (like the simulator) can be used
 from time import sleep      # import the sleep functions
+import threading
+import time
+from collections import OrderedDict
+import bisect
+import functools
+import logging
 
-i2c = smbus.SMBus(1)        # create an i2c object for writing/reading from i2c
+logger = logging.getLogger(__name__)
+
+_monotonic = getattr(time, "monotonic", time.time)     # clock for scheduling (time.monotonic needs Python 3.3)
+
+
+# base class for the errors raised by this library
+class I2c7SegmentLedError(IOError):
+    pass
+
+# an i2c transfer with a display failed (after retrying)
+class I2cTransferError(I2c7SegmentLedError):
+
+    def __init__(self, i2cAddress, reg, cause):
+        I2c7SegmentLedError.__init__(self, "i2c 7 Segment Led at address 0x%02x: register 0x%02x failed: %s" %(i2cAddress, reg, cause))
+        self.i2cAddress = i2cAddress
+        self.reg = reg
+        self.cause = cause
+
+# a display is offline after too many failures, so its transfers are not attempted
+class DisplayOfflineError(I2c7SegmentLedError):
+
+    def __init__(self, i2cAddress):
+        I2c7SegmentLedError.__init__(self, "i2c 7 Segment Led at address 0x%02x is offline" %i2cAddress)
+        self.i2cAddress = i2cAddress
+
+
+# a latency histogram with fixed bucket limits (in seconds)
+class LatencyHistogram(object):
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)      # the last count is for values above all buckets
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    # return the histogram as a dictionary with cumulative bucket counts (like Prometheus)
+    def snapshot(self):
+        cumulative = []
+        total = 0
+        for limit, count in zip(self.buckets, self.counts):
+            total += count
+            cumulative.append((limit, total))
+        return {"buckets": cumulative, "count": self.count, "sum": self.sum}
+
+
+# optional counters and latency histograms for the i2c traffic of the displays, per display and per bus,
+# and for the time taken by the main I2c7SegmentLed calls. It is off until enable() is called, and while
+# it is off it only costs one attribute check per transfer. Use the module's stats object:
+#     from I2c7SegmentLed import stats
+#     stats.enable()
+#     ...
+#     print(stats.prometheus())
+class I2cStats(object):
+
+    BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self.reset()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    # clear all counters
+    def reset(self):
+        with self._lock:
+            self._displays = {}         # (bus label, address) -> counters
+            self._buses = {}            # bus label -> counters
+            self._calls = {}            # call name -> LatencyHistogram
+
+    def _counters(self):
+        return {"transactions": 0, "messages": 0, "bytesWritten": 0, "errors": 0,
+                "latency": LatencyHistogram(I2cStats.BUCKETS)}
+
+    # record one bus transaction of a display (messages register writes/reads, byteCount bytes written)
+    def recordTransfer(self, bus, address, messages, byteCount, ok, seconds):
+        label = bus.label()
+        with self._lock:
+            for key, table in (((label, address), self._displays), (label, self._buses)):
+                counters = table.get(key)
+                if counters is None:
+                    counters = table[key] = self._counters()
+                counters["transactions"] += 1
+                counters["messages"] += messages
+                counters["bytesWritten"] += byteCount
+                if not ok:
+                    counters["errors"] += 1
+                counters["latency"].observe(seconds)
+
+    # record a combined transaction on a bus, displays is a dictionary of display -> number of messages,
+    # failed the displays that had a message fail. bytesPerMessage is 2 for writes and 1 for reads.
+    def recordBatch(self, bus, displays, failed, seconds, bytesPerMessage=2):
+        label = bus.label()
+        with self._lock:
+            messages = sum(displays.values())
+            for key, table, count, error in [((label, display._i2cAddress), self._displays, displays[display], display in failed)
+                                             for display in displays] + [(label, self._buses, messages, bool(failed))]:
+                counters = table.get(key)
+                if counters is None:
+                    counters = table[key] = self._counters()
+                counters["transactions"] += 1
+                counters["messages"] += count
+                counters["bytesWritten"] += bytesPerMessage * count
+                if error:
+                    counters["errors"] += 1
+                counters["latency"].observe(seconds)
+
+    # record the time taken by a call
+    def recordCall(self, name, seconds):
+        with self._lock:
+            histogram = self._calls.get(name)
+            if histogram is None:
+                histogram = self._calls[name] = LatencyHistogram(I2cStats.BUCKETS)
+            histogram.observe(seconds)
+
+    @staticmethod
+    def _snapshotCounters(counters):
+        result = dict(counters)
+        result["latency"] = counters["latency"].snapshot()
+        return result
+
+    # return the counters of one display (None if nothing was recorded for it)
+    def display(self, display):
+        with self._lock:
+            counters = self._displays.get((display._bus.label(), display._i2cAddress))
+            return None if counters is None else I2cStats._snapshotCounters(counters)
+
+    # return all counters as a dictionary with "displays", "buses" and "calls" entries
+    def snapshot(self):
+        with self._lock:
+            return {
+                "displays": dict(("%s/0x%02x" %key, I2cStats._snapshotCounters(counters)) for key, counters in self._displays.items()),
+                "buses": dict((key, I2cStats._snapshotCounters(counters)) for key, counters in self._buses.items()),
+                "calls": dict((key, histogram.snapshot()) for key, histogram in self._calls.items()),
+            }
+
+    # return all counters in the Prometheus text exposition format
+    def prometheus(self, prefix="i2c7segmentled"):
+        lines = []
+
+        def histogram(name, labels, snapshot):
+            for limit, count in snapshot["buckets"]:
+                lines.append('%s_bucket{%s,le="%g"} %d' %(name, labels, limit, count))
+            lines.append('%s_bucket{%s,le="+Inf"} %d' %(name, labels, snapshot["count"]))
+            lines.append('%s_sum{%s} %.9f' %(name, labels, snapshot["sum"]))
+            lines.append('%s_count{%s} %d' %(name, labels, snapshot["count"]))
+
+        snapshot = self.snapshot()
+        for kind, entries in (("display", snapshot["displays"]), ("bus", snapshot["buses"])):
+            for metric, key in (("transactions_total", "transactions"), ("messages_total", "messages"),
+                                ("bytes_written_total", "bytesWritten"), ("errors_total", "errors")):
+                name = "%s_%s_%s" %(prefix, kind, metric)
+                lines.append("# TYPE %s counter" %name)
+                for entry, counters in sorted(entries.items()):
+                    lines.append('%s{%s} %d' %(name, I2cStats._labels(kind, entry), counters[key]))
+            name = "%s_%s_transfer_seconds" %(prefix, kind)
+            lines.append("# TYPE %s histogram" %name)
+            for entry, counters in sorted(entries.items()):
+                histogram(name, I2cStats._labels(kind, entry), counters["latency"])
+        name = "%s_call_seconds" %prefix
+        lines.append("# TYPE %s histogram" %name)
+        for call, snapshotCall in sorted(snapshot["calls"].items()):
+            histogram(name, 'call="%s"' %call, snapshotCall)
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _labels(kind, key):
+        if kind == "display":
+            bus, address = key.rsplit("/", 1)
+            return 'bus="%s",address="%s"' %(bus, address)
+        return 'bus="%s"' %key
+
+
+stats = I2cStats()          # the statistics of all displays, off until stats.enable() is called
+
+
+# decorator recording the time taken by an I2c7SegmentLed call in stats, when stats are enabled
+def _timed(name):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not stats.enabled:
+                return function(*args, **kwargs)
+            started = _monotonic()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                stats.recordCall(name, _monotonic() - started)
+        return wrapper
+    return decorator
+
+
+# do one bus transfer without retries (like function(address, reg, value) for a write), recording it
+# in stats when stats are enabled. Used for the transfers to chips that may not answer yet.
+def _recorded(bus, function, address, reg, *args):
+    if not stats.enabled:
+        return function(address, reg, *args)
+    started = _monotonic()
+    ok = False
+    try:
+        result = function(address, reg, *args)
+        ok = True
+        return result
+    finally:
+        stats.recordTransfer(bus, address, 1, 1 + len(args), ok, _monotonic() - started)
+
+
+# read (display, register) pairs with bus.readBatch(), recording the transaction in stats
+def _readBatch(bus, reads):
+    enabled = stats.enabled     # read once, so stats switched on during the read don't see a missing start time
+    if enabled:
+        started = _monotonic()
+    values = bus.readBatch([(display._i2cAddress, reg) for display, reg in reads])
+    if enabled:
+        counts = {}
+        failed = set()
+        for (display, reg), value in zip(reads, values):
+            counts[display] = counts.get(display, 0) + 1
+            if value is None:
+                failed.add(display)
+        stats.recordBatch(bus, counts, failed, _monotonic() - started, bytesPerMessage=1)
+    return values
+
+
+# base class for the i2c bus backends used by I2c7SegmentLed.
+# A backend provides the smbus style write_byte_data() and read_byte_data() methods, which raise
+# an IOError/OSError when the device does not acknowledge, and writeBatch() for sending many writes at once.
+# Every backend has a lock, which callers can also hold to keep a sequence of transactions together.
+class I2cBus(object):
+
+    def __init__(self):
+        self.lock = threading.RLock()
+
+    # write value to register reg of the device at address
+    def write_byte_data(self, address, reg, value):
+        raise NotImplementedError
+
+    # read register reg of the device at address
+    def read_byte_data(self, address, reg):
+        raise NotImplementedError
+
+    # write a list of (address, register, value) tuples, returns the list of writes that failed
+    def writeBatch(self, writes):
+        failed = []
+        with self.lock:
+            for address, reg, value in writes:
+                try:
+                    self.write_byte_data(address, reg, value)
+                except (IOError, OSError):
+                    failed.append((address, reg, value))
+        return failed
+
+    # read a list of (address, register) pairs, returns the values read (None for the reads that failed)
+    def readBatch(self, reads):
+        values = []
+        with self.lock:
+            for address, reg in reads:
+                try:
+                    values.append(self.read_byte_data(address, reg))
+                except (IOError, OSError):
+                    values.append(None)
+        return values
+
+    # release the bus
+    def close(self):
+        pass
+
+    # name of the bus used in statistics
+    def label(self):
+        return "%s-%x" %(type(self).__name__, id(self))
+
+
+# i2c bus backend using an smbus.SMBus or smbus2.SMBus object
+class SMBusBackend(I2cBus):
+
+    MAX_MESSAGES = 42       # the kernel accepts at most 42 messages in one I2C_RDWR transaction
+
+    # bus is an i2c bus number (like 1 for /dev/i2c-1), which is opened on first use,
+    # or an already opened SMBus object
+    def __init__(self, bus=1):
+        I2cBus.__init__(self)
+        self.busNumber = None
+        self._smbus = None
+        if isinstance(bus, int):
+            self.busNumber = bus
+        else:
+            self._smbus = bus
+
+    # return the SMBus object, opening the bus if needed (call with the lock held)
+    def _open(self):
+        if self._smbus is None:
+            if smbus is None:
+                raise ImportError("the smbus or smbus2 library is needed to open i2c bus %d" %self.busNumber)
+            self._smbus = smbus.SMBus(self.busNumber)
+        return self._smbus
+
+    def write_byte_data(self, address, reg, value):
+        with self.lock:
+            self._open().write_byte_data(address, reg, value)
+
+    def read_byte_data(self, address, reg):
+        with self.lock:
+            return self._open().read_byte_data(address, reg)
+
+    # send the writes as combined I2C_RDWR transactions when smbus2 is available
+    def writeBatch(self, writes):
+        with self.lock:
+            bus = self._open()
+            if i2c_msg is None or not hasattr(bus, "i2c_rdwr") or len(writes) < 2:
+                return I2cBus.writeBatch(self, writes)
+            failed = []
+            for start in range(0, len(writes), SMBusBackend.MAX_MESSAGES):
+                group = writes[start:start+SMBusBackend.MAX_MESSAGES]
+                try:
+                    bus.i2c_rdwr(*[i2c_msg.write(address, [reg, value]) for address, reg, value in group])
+                except (IOError, OSError):
+                    failed.extend(group)        # we can't tell which message was not acknowledged
+            return failed
+
+    # read the registers with combined I2C_RDWR transactions (a write of the register number
+    # and a read of one byte for each register) when smbus2 is available
+    def readBatch(self, reads):
+        with self.lock:
+            bus = self._open()
+            if i2c_msg is None or not hasattr(bus, "i2c_rdwr") or len(reads) < 2:
+                return I2cBus.readBatch(self, reads)
+            values = []
+            perTransaction = SMBusBackend.MAX_MESSAGES // 2
+            for start in range(0, len(reads), perTransaction):
+                group = reads[start:start+perTransaction]
+                messages = []
+                for address, reg in group:
+                    messages.append(i2c_msg.write(address, [reg]))
+                    messages.append(i2c_msg.read(address, 1))
+                try:
+                    bus.i2c_rdwr(*messages)
+                    values.extend(list(message)[0] for message in messages[1::2])
+                except (IOError, OSError):
+                    values.extend(I2cBus.readBatch(self, group))    # find out which reads fail
+            return values
+
+    def label(self):
+        if self.busNumber is None:
+            return I2cBus.label(self)
+        return "i2c-%d" %self.busNumber
+
+    # close the bus, it will be opened again if it is used later
+    def close(self):
+        with self.lock:
+            if self._smbus is not None and self.busNumber is not None:
+                self._smbus.close()
+                self._smbus = None
+
+
+# a pool of i2c buses keyed by bus number. Every display on the same bus shares one
+# SMBusBackend (one open file and one lock), and a bus is only opened when it is first used,
+# so displays on different buses never wait for each other. SMBus objects opened by the caller
+# also get one shared backend each.
+class I2cBusPool(object):
+
+    def __init__(self):
+        self._buses = {}
+        self._handles = {}          # id(SMBus object) -> (SMBus object, its SMBusBackend)
+        self._lock = threading.Lock()
+
+    # return the shared backend for this bus number
+    def get(self, busNumber):
+        with self._lock:
+            if busNumber not in self._buses:
+                self._buses[busNumber] = SMBusBackend(busNumber)
+            return self._buses[busNumber]
+
+    # return the shared backend for an SMBus object
+    def wrap(self, handle):
+        with self._lock:
+            entry = self._handles.get(id(handle))
+            if entry is None or entry[0] is not handle:
+                entry = (handle, SMBusBackend(handle))      # the handle is kept, so its id can't be reused
+                self._handles[id(handle)] = entry
+            return entry[1]
+
+    # close all open buses
+    def closeAll(self):
+        with self._lock:
+            for bus in self._buses.values():
+                bus.close()
+
+
+busPool = I2cBusPool()      # the pool used by displays created with a bus number
+
+# return the default bus (i2c bus 1), which is opened on first use
+def defaultBus():
+    return busPool.get(1)
+
+# return the I2cBus backend for a bus number, an I2cBus, or an SMBus object (None is the default bus)
+def getBus(bus=None):
+    if bus is None:
+        return defaultBus()
+    if isinstance(bus, I2cBus):
+        return bus
+    if isinstance(bus, int):
+        return busPool.get(bus)
+    return busPool.wrap(bus)
+
+# tell all AS1115 chips on a bus that are still at the factory address (i2c address 0, after power up)
+# to use their hardware jumpered i2c address. This takes about 40 ms when there are such chips, and
+# only needs to be done once for all the chips on the bus, see initializeFleet().
+# (a chip jumpered to address 0 always answers there, so with such a chip the 40 ms are always spent)
+def selfAddressAll(bus=None):
+    bus = getBus(bus)
+
+    # Start talking to the AS1115 chips, as they will be at i2c address 0 initially (upon powerup)
+
+    # Power up the AS1115 chips
+    try:
+        _recorded(bus, bus.write_byte_data, 0x00, I2c7SegmentLed.REG_SHUTDOWN, I2c7SegmentLed.REG_SHUTDOWN_NORMAL)
+    except (IOError, OSError):
+        return      # an error just means that the i2c led displays have already had their address set
+    sleep(0.020)
+
+    # tell all AS1115 chips to use their hardware jumpered i2c address
+    try:
+        _recorded(bus, bus.write_byte_data, 0x00, I2c7SegmentLed.REG_SELF_ADDRESSING, I2c7SegmentLed.REG_SELF_ADDRESSING_USER_ADDRESS)
+    except (IOError, OSError):
+        pass        # an error just means that the i2c led displays have already had their address set
+    sleep(0.020)
+
+# create the I2c7SegmentLed objects for many displays, doing the self addressing only once per bus.
+# modules is a list of (i2cAddress, digits) or (i2cAddress, digits, bus) tuples, bus is the default bus.
+# With attach=True, displays that are already configured keep their contents (see I2c7SegmentLed.attach()).
+def initializeFleet(modules, bus=None, attach=True):
+    buses = []
+    for module in modules:
+        moduleBus = getBus(module[2] if len(module) > 2 else bus)
+        if moduleBus not in buses:
+            selfAddressAll(moduleBus)
+            buses.append(moduleBus)
+    displays = []
+    for module in modules:
+        moduleBus = getBus(module[2] if len(module) > 2 else bus)
+        displays.append(I2c7SegmentLed(module[0], module[1], moduleBus, attach=attach, selfAddress=False))
+    return displays
 
 # create a class for the i2c 7 segment led displays that use the AS1115 chip
 class I2c7SegmentLed(object):
@@ -112,12 +576,37 @@ class I2c7SegmentLed(object):
     REG_FEATURE_SYNC = 0x40             # set bit for multiple device blinking
     REG_FEATURE_BLINK_START = 0x80      # set bit to start blinking when display turns on, clear to start blinking when display turns off
 
+    # REG_DISPLAY_TEST_MODE bit values
+    REG_DISPLAY_TEST_MODE_OPTICAL = 0x01     # set bit to turn on all segments
+    REG_DISPLAY_TEST_MODE_LED_SHORT = 0x02   # set bit to start a test for shorted segments
+    REG_DISPLAY_TEST_MODE_LED_OPEN = 0x04    # set bit to start a test for open segments
+    REG_DISPLAY_TEST_MODE_LED_TEST = 0x08    # (read only) set while a segment test is running
+    REG_DISPLAY_TEST_MODE_LED_GLOBAL = 0x10  # (read only) set if the last segment test found a fault
+    REG_DISPLAY_TEST_MODE_RSET_OPEN = 0x20   # (read only) set if the RSET resistor is open
+    REG_DISPLAY_TEST_MODE_RSET_SHORT = 0x40  # (read only) set if the RSET resistor is shorted
+
+    # all the REG_FEATURE bits that control blinking
+    BLINK_BITS = REG_FEATURE_BLINK | REG_FEATURE_BLINK_FREQUENCY | REG_FEATURE_SYNC | REG_FEATURE_BLINK_START
+
     DECIMAL_POINT_MASK = 0x80           # bit to control the decimal point
 
+    # error handling: a failed transfer is retried up to RETRIES times, waiting RETRY_DELAY seconds and then
+    # doubling the wait. After OFFLINE_AFTER failures in a row the display is offline: its writes fail
+    # at once without using the bus, and every PROBE_INTERVAL seconds a write checks if it answers again.
+    # (these can be changed per display with the retries, retryDelay, offlineAfter and probeInterval attributes)
+    RETRIES = 2
+    RETRY_DELAY = 0.001
+    OFFLINE_AFTER = 3
+    PROBE_INTERVAL = 5.0
+
+    # control registers whose last written value is remembered, so that writing the same value again is skipped
+    CACHED_REGISTERS = (REG_DECODE_MODE, REG_GLOBAL_INTENSITY, REG_SCAN_LIMIT, REG_SHUTDOWN, REG_FEATURE,
+                        REG_DIGIT01_INTENSITY, REG_DIGIT23_INTENSITY, REG_DIGIT45_INTENSITY, REG_DIGIT67_INTENSIGY)
+
     # segment values for the LED for all 128 ASCII characters
     # the first value is for ASCII character 0, then 1, etc
     # each byte contains the 7 LED segments and the decimal point, arranged as (from MSB to LSB)
-    #    DP G F E D C B A   (DP, middle, top left, btm left, btm, btm right, top right, top)
+    #    DP A B C D E F G   (DP, top, top right, btm right, btm, btm left, top left, middle)
     # if a bit is a '1', then that segment of the led will be turned on.
     LedSegments = [
         0b01111110,0b00110000,0b01101101,0b01111001,0b00110011,0b01011011,0b01011111,0b01110010,  # Ascii decimal:0-7       hex:00-07
@@ -140,28 +629,51 @@ class I2c7SegmentLed(object):
 
 
     # constructor to create I2c7SegmentLed object, and initialize the LED module
-    def __init__(self, i2cAddress, digits):
+    # bus is an i2c bus number, an I2cBus backend or an SMBus object, the default is i2c bus 1
+    # attach=True reuses the configuration and digits of a chip that is already set up (see attach())
+    # selfAddress=False skips telling the chips to use their jumpered address (see selfAddressAll())
+    # configure=False doesn't talk to the chip at all, call attach() and/or initialize() later
+    # font is the SegmentFont used for characters, the default is defaultFont
+    @_timed("init")
+    def __init__(self, i2cAddress, digits, bus=None, attach=False, selfAddress=True, configure=True, font=None):
+        self._bus = getBus(bus)
+        self._font = font if font is not None else defaultFont
+        self.retries = I2c7SegmentLed.RETRIES
+        self.retryDelay = I2c7SegmentLed.RETRY_DELAY
+        self.offlineAfter = I2c7SegmentLed.OFFLINE_AFTER
+        self.probeInterval = I2c7SegmentLed.PROBE_INTERVAL
         self._digits = digits
         self._i2cAddress = i2cAddress
         self._feature = 0
         self._segments = [0,0,0,0,0,0,0,0,0]
+        self._shown = [None,None,None,None,None,None,None,None,None]   # segments the chip last acknowledged (None = unknown)
+        self._registers = {}                      # CACHED_REGISTERS values the chip last acknowledged
+        self._desired = {}                        # CACHED_REGISTERS values last written (acknowledged or not)
+        self._digitBrightness = [None,None,None,None,None,None,None,None,None]   # per digit brightness (None = not set)
+        self.offline = False                      # True after offlineAfter failures in a row, until a probe succeeds
+        self._failures = 0                        # failed transfers in a row
+        self._nextProbe = 0.0
+        self.errorCount = 0                       # failed i2c transfers (including retried ones)
+        self.retryCount = 0                       # transfers that were retried
+        self.offlineCount = 0                     # times the display went offline
+        self._frameMode = False                   # when True, digit writes only update _segments until flush()
+        self._batch = None                        # I2cBatch that is currently collecting our register writes
         self._cursorPosition = 1
 
-        # Start talking to the AS1115 chip, as it will be at i2c address 0 initially (upon powerup)
+        if not configure:
+            return
 
-        # Power down the AS1115 chip
-        try:
-            i2c.write_byte_data(0x00, I2c7SegmentLed.REG_SHUTDOWN, I2c7SegmentLed.REG_SHUTDOWN_NORMAL)
-        except:
-            pass        # an error just means that the i2c led display has already had it's address set
-        sleep(0.020)
+        if attach and self.attach():
+            return                                # the chip is already running with our settings
 
-        # tell all AS1115 chips to use their hardware jumpered i2c address
-        try:
-            i2c.write_byte_data(0x00, I2c7SegmentLed.REG_SELF_ADDRESSING, I2c7SegmentLed.REG_SELF_ADDRESSING_USER_ADDRESS)
-        except:
-            pass        # an error just means that the i2c led display has already had it's address set
-        sleep(0.020)
+        if selfAddress:
+            selfAddressAll(self._bus)
+        self.initialize()
+
+    # power up, reset and configure the AS1115 chip, and clear the display
+    @_timed("initialize")
+    def initialize(self):
+        self.invalidate()                         # send every register, even if we think the chip already has it
 
         # power up and reset the AS1115 chip and the feature register
         self.setRegister(I2c7SegmentLed.REG_SHUTDOWN, I2c7SegmentLed.REG_SHUTDOWN_NORMAL_AND_RESET)
@@ -176,24 +688,247 @@ class I2c7SegmentLed(object):
 
         self.clear()                             # clear the display
 
-    # write value to register
+    # probe the chip at its jumpered address, and if it is already configured for this display
+    # (same number of digits, no decoding), take over its feature register and digits without
+    # resetting or clearing it. Returns False if the chip did not answer or needs initializing.
+    @_timed("attach")
+    def attach(self):
+        try:
+            with self._bus.lock:
+                scanLimit = self._probeRead(I2c7SegmentLed.REG_SCAN_LIMIT)
+                decodeMode = self._probeRead(I2c7SegmentLed.REG_DECODE_MODE)
+                if scanLimit != self._digits-1 or decodeMode != I2c7SegmentLed.REG_DECODE_MODE_NO_DIGITS:
+                    return False
+                feature = self._probeRead(I2c7SegmentLed.REG_FEATURE)
+                shutdown = self._probeRead(I2c7SegmentLed.REG_SHUTDOWN)
+                intensity = self._probeRead(I2c7SegmentLed.REG_GLOBAL_INTENSITY)
+                segments = [self._probeRead(digit) for digit in range(1, self._digits+1)]
+        except (IOError, OSError):
+            return False        # no chip at this address yet (it may still be using the factory address)
+        if scanLimit == 0 and intensity == 0 and feature == 0 and not any(segments):
+            return False        # power up values (which match a 1 digit display), the chip was never configured
+        self._feature = feature
+        self._registers = {I2c7SegmentLed.REG_SCAN_LIMIT: scanLimit, I2c7SegmentLed.REG_DECODE_MODE: decodeMode,
+                           I2c7SegmentLed.REG_FEATURE: feature, I2c7SegmentLed.REG_SHUTDOWN: shutdown,
+                           I2c7SegmentLed.REG_GLOBAL_INTENSITY: intensity}
+        self._desired = dict(self._registers)
+        for digit in range(1, self._digits+1):
+            self._segments[digit] = segments[digit-1]
+            self._shown[digit] = segments[digit-1]
+        self._cursorPosition = 1
+        return True
+
+    # write value to register, returns True if the chip acknowledged the write
+    # (inside a batch the write is queued, and a failure is reported when the batch is flushed)
+    # Writing a control register with the value it already has is skipped (see CACHED_REGISTERS).
     def setRegister(self, reg, value):
         try:
-            i2c.write_byte_data(self._i2cAddress, reg, value)
-        except:
-            print("Error writing to i2c 7 Segment Led at Address 0x%02x" %self._i2cAddress  )
+            self.writeRegister(reg, value)
+            return True
+        except I2c7SegmentLedError:
+            return False
 
-    # write the 8 segments to this digit of the led
+    # same as setRegister(), but raises I2cTransferError if the chip does not acknowledge the write
+    # (after retrying), or DisplayOfflineError if the display is offline (see I2c7SegmentLed.OFFLINE_AFTER)
+    def writeRegister(self, reg, value):
+        I2c7SegmentLed._applyRegister(self._desired, reg, value)
+        if reg in self._registers and self._registers[reg] == value:
+            return
+        self._checkOnline()
+        if self._batch is not None:
+            self._batch.add(self, reg, value)
+            I2c7SegmentLed._applyRegister(self._registers, reg, value)
+            return
+        try:
+            self._transfer(self._bus.write_byte_data, reg, value)
+        except I2c7SegmentLedError:
+            self._registers.pop(reg, None)
+            raise
+        I2c7SegmentLed._applyRegister(self._registers, reg, value)
+
+    # read a register, returns None if the chip did not respond
+    def getRegister(self, reg):
+        try:
+            return self.readRegister(reg)
+        except I2c7SegmentLedError:
+            return None
+
+    # same as getRegister(), but raises I2cTransferError or DisplayOfflineError if the read fails
+    def readRegister(self, reg):
+        self._checkOnline()
+        return self._transfer(self._bus.read_byte_data, reg)
+
+    # do one i2c transfer, retrying with a doubling delay if it fails
+    def _transfer(self, function, reg, *args):
+        delay = self.retryDelay
+        for attempt in range(self.retries + 1):
+            enabled = stats.enabled     # read once per attempt, stats can be switched on from another thread
+            if enabled:
+                started = _monotonic()
+            try:
+                result = function(self._i2cAddress, reg, *args)
+                if enabled:
+                    stats.recordTransfer(self._bus, self._i2cAddress, 1, 1 + len(args), True, _monotonic() - started)
+                self._transferResult(True)
+                return result
+            except (IOError, OSError) as error:
+                if enabled:
+                    stats.recordTransfer(self._bus, self._i2cAddress, 1, 1 + len(args), False, _monotonic() - started)
+                lastError = error
+                self.errorCount += 1
+                if attempt < self.retries:
+                    self.retryCount += 1
+                    sleep(delay)
+                    delay *= 2
+        logger.debug("i2c 7 Segment Led at address 0x%02x: register 0x%02x failed: %s", self._i2cAddress, reg, lastError)
+        self._transferResult(False)
+        raise I2cTransferError(self._i2cAddress, reg, lastError)
+
+    # update the circuit breaker after a transfer (or a batch of transfers) succeeded or failed
+    def _transferResult(self, ok):
+        if ok:
+            self._failures = 0
+            return
+        self._failures += 1
+        if self._failures == 1:
+            logger.warning("Error writing to i2c 7 Segment Led at Address 0x%02x", self._i2cAddress)
+        if self._failures >= self.offlineAfter and not self.offline:
+            self.offline = True
+            self.offlineCount += 1
+            self._nextProbe = _monotonic() + self.probeInterval
+            logger.error("i2c 7 Segment Led at address 0x%02x is offline after %d failures, probing every %g s",
+                         self._i2cAddress, self._failures, self.probeInterval)
+
+    # raise DisplayOfflineError if the display is offline, unless it is time to probe it and it answers
+    def _checkOnline(self):
+        if self.offline and (_monotonic() < self._nextProbe or not self.probe()):
+            raise DisplayOfflineError(self._i2cAddress)
+
+    # read a register once, without retries or counting failures (for chips that may not answer yet)
+    def _probeRead(self, reg):
+        return _recorded(self._bus, self._bus.read_byte_data, self._i2cAddress, reg)
+
+    # check whether an offline display answers again. If it does, it is put back online and its
+    # registers and digits are written to it again (see resync()). Returns True if the display is online.
+    def probe(self):
+        if not self.offline:
+            return True
+        try:
+            self._probeRead(I2c7SegmentLed.REG_SCAN_LIMIT)
+        except (IOError, OSError):
+            selfAddressAll(self._bus)   # it may have lost power and be back at the factory address
+            try:
+                self._probeRead(I2c7SegmentLed.REG_SCAN_LIMIT)
+            except (IOError, OSError):
+                self._nextProbe = _monotonic() + self.probeInterval
+                return False
+        self.offline = False
+        self._failures = 0
+        logger.info("i2c 7 Segment Led at address 0x%02x is back online", self._i2cAddress)
+        self.resync()
+        return True
+
+    # apply a register write to a register shadow dictionary, including the chip's side effects
+    @staticmethod
+    def _applyRegister(registers, reg, value):
+        if reg == I2c7SegmentLed.REG_FEATURE and value & I2c7SegmentLed.REG_FEATURE_RESET:
+            registers.clear()           # the chip reset all its control registers
+            return
+        if reg == I2c7SegmentLed.REG_SHUTDOWN and not value & 0x80:
+            registers[I2c7SegmentLed.REG_FEATURE] = 0     # these shutdown values reset the feature register
+        if reg in I2c7SegmentLed.CACHED_REGISTERS:
+            registers[reg] = value
+
+    # forget what the chip is showing and how it is set up, so that the next writes are all sent
+    # (use after the chip may have lost power or been written by another program)
+    def invalidate(self):
+        self._registers = {}
+        self._shown = [None,None,None,None,None,None,None,None,None]
+
+    # write the control registers and all digits to the chip again, for example after it
+    # lost power. Chips that came back at the factory address are self addressed first.
+    def resync(self):
+        self.invalidate()
+        selfAddressAll(self._bus)
+        registers = dict(self._desired)
+        with self.batch():
+            for reg in (I2c7SegmentLed.REG_SHUTDOWN, I2c7SegmentLed.REG_SCAN_LIMIT, I2c7SegmentLed.REG_DECODE_MODE,
+                        I2c7SegmentLed.REG_GLOBAL_INTENSITY, I2c7SegmentLed.REG_DIGIT01_INTENSITY,
+                        I2c7SegmentLed.REG_DIGIT23_INTENSITY, I2c7SegmentLed.REG_DIGIT45_INTENSITY,
+                        I2c7SegmentLed.REG_DIGIT67_INTENSIGY, I2c7SegmentLed.REG_FEATURE):
+                if reg in registers:
+                    self.setRegister(reg, registers[reg])
+            self.flush()
+
+    # called by I2cBatch when a queued register write was not acknowledged
+    def _writeFailed(self, reg):
+        if (reg <= self._digits) and (reg >= 1):
+            self._shown[reg] = None     # we no longer know what this digit shows, so the next flush() resends it
+        self._registers.pop(reg, None)
+
+    # return an I2cBatch for this display, so that all register writes inside
+    #     with led.batch():
+    # are sent to the chip as one combined i2c transaction
+    def batch(self):
+        return I2cBatch(self)
+
+    # write the 8 segments to this digit of the led (in frame mode only the local storage is updated)
     def setSegments(self, digit, segments):
         if (digit <= self._digits) and (digit >= 1):
-            self.setRegister(digit, segments)
             self._segments[digit] = segments
+            if not self._frameMode:
+                if self.setRegister(digit, segments):
+                    self._shown[digit] = segments
+
+    # start a frame: following writes only change the local storage until endFrame() or flush() is called
+    def beginFrame(self):
+        self._frameMode = True
+
+    # end a frame and send the digits that changed to the display
+    def endFrame(self):
+        self._frameMode = False
+        self.flush()
+
+    # return the digits whose local storage differs from what the chip last acknowledged
+    def changedDigits(self):
+        return [digit for digit in range(1, self._digits+1) if self._shown[digit] != self._segments[digit]]
+
+    # send only the digits whose local storage differs from what the chip last acknowledged
+    @_timed("flush")
+    def flush(self):
+        for digit in self.changedDigits():
+            segments = self._segments[digit]
+            if self.setRegister(digit, segments):
+                self._shown[digit] = segments
+
+    # replace the whole display with a string (same as clear() followed by writeString())
+    # as one update, so that only the digits that changed are written and the display never blanks
+    @_timed("show")
+    def show(self, value):
+        segments, used = self._font.compile(value, self._digits)
+        self.showSegments(segments)
+        self._cursorPosition = used + 1
+
+    # set the font used for characters
+    def setFont(self, font):
+        self._font = font
+
+    # replace the whole display with a list of segment values (one per digit, starting at digit 1),
+    # writing only the digits that changed
+    @_timed("showSegments")
+    def showSegments(self, segments):
+        for digit in range(1, self._digits+1):
+            self._segments[digit] = segments[digit-1] if digit <= len(segments) else 0x00
+        self._cursorPosition = 1
+        if not self._frameMode:
+            self.flush()
 
     # set the brightness to value (0-15)
     def setBrightness(self, value):
         self.setRegister(I2c7SegmentLed.REG_GLOBAL_INTENSITY, value)
 
     # clear all digits of the LED
+    @_timed("clear")
     def clear(self):
         for i in range(1,self._digits+1):
             self._segments[i] = 0x00    # clear local storage
@@ -217,11 +952,63 @@ class I2c7SegmentLed(object):
     def displayOn(self):
         self.setRegister(I2c7SegmentLed.REG_SHUTDOWN,I2c7SegmentLed.REG_SHUTDOWN_NORMAL)
 
+    # make the whole display blink, using the chip's own blink timer (no work for the Raspberry Pi after this).
+    # slow=True blinks with a 2 second period instead of 1 second, startOn=False starts the blink cycle
+    # with the display off, and sync=True sets the chip's blink synchronization bit (see blinkGroup())
+    def blinkOn(self, slow=False, startOn=True, sync=False):
+        feature = self._feature & ~I2c7SegmentLed.BLINK_BITS | I2c7SegmentLed.REG_FEATURE_BLINK
+        if slow:
+            feature |= I2c7SegmentLed.REG_FEATURE_BLINK_FREQUENCY
+        if startOn:
+            feature |= I2c7SegmentLed.REG_FEATURE_BLINK_START
+        if sync:
+            feature |= I2c7SegmentLed.REG_FEATURE_SYNC
+        self._feature = feature
+        self.setRegister(I2c7SegmentLed.REG_FEATURE, self._feature)
+
+    # stop blinking
+    def blinkOff(self):
+        self._feature &= ~I2c7SegmentLed.BLINK_BITS
+        self.setRegister(I2c7SegmentLed.REG_FEATURE, self._feature)
+
+    # True if the display is set to blink
+    def isBlinking(self):
+        return bool(self._feature & I2c7SegmentLed.REG_FEATURE_BLINK)
+
     # set the brightness of the LEDs to value (0-15)
     def setBrightness(self, value):
         self.setRegister(I2c7SegmentLed.REG_GLOBAL_INTENSITY, value)
 
+    # set the brightness of one digit to value (0-15), using the chip's per digit intensity registers
+    def setDigitBrightness(self, digit, value):
+        if (digit <= self._digits) and (digit >= 1):
+            self._digitBrightness[digit] = value & 0x0f
+            self._writeDigitBrightness()
+
+    # set the brightness of digits 1, 2, ... to the values in a list (0-15 each). Two digits share
+    # an intensity register, and only the registers whose value changed are written.
+    def setDigitBrightnesses(self, values):
+        for digit in range(1, min(len(values), self._digits) + 1):
+            self._digitBrightness[digit] = values[digit-1] & 0x0f
+        self._writeDigitBrightness()
+
+    def _writeDigitBrightness(self):
+        for reg, value in self.digitBrightnessRegisters(self._digitBrightness[1:]):
+            self.setRegister(reg, value)
+
+    # return the (register, value) pairs for the per digit intensity registers, for a list of digit
+    # brightness values (digits without a value, None, get the global brightness)
+    def digitBrightnessRegisters(self, levels):
+        default = self._desired.get(I2c7SegmentLed.REG_GLOBAL_INTENSITY, 15) & 0x0f
+        registers = []
+        for pair in range((self._digits + 1) // 2):
+            low = levels[2*pair] if 2*pair < len(levels) and levels[2*pair] is not None else default
+            high = levels[2*pair+1] if 2*pair+1 < len(levels) and levels[2*pair+1] is not None else default
+            registers.append((I2c7SegmentLed.REG_DIGIT01_INTENSITY + pair, (high << 4) | low))
+        return registers
+
     # set the decimal point on digit specified
+    @_timed("setDecimalPoint")
     def setDecimalPoint(self, digit):
         if (digit <= self._digits) and (digit >= 1):
             currentSegments = self._segments[digit] | I2c7SegmentLed.DECIMAL_POINT_MASK
@@ -246,12 +1033,1089 @@ class I2c7SegmentLed(object):
                     self.setDecimalPoint(self._cursorPosition-1);     # set the dp for the previous digit
             # else it is not a decimal point
             else:
-                self._segments[self._cursorPosition] = I2c7SegmentLed.LedSegments[ord(value)];     # save the segments to local storage
-                self.setSegments(self._cursorPosition, I2c7SegmentLed.LedSegments[ord(value)]);   # write the segments to the display
+                segments = self._font.glyph(value)
+                self._segments[self._cursorPosition] = segments;     # save the segments to local storage
+                self.setSegments(self._cursorPosition, segments);   # write the segments to the display
                 self._cursorPosition += 1
 
     # write a string (including formatting options)
     # For examples of printing numbers:  https://mkaz.tech/python-string-format.html
+    @_timed("writeString")
     def writeString(self, value):
         for char in value:
             self.write(char)
+
+
+# make a group of displays blink in step, using the chips' own blink timers. Blinking is stopped and
+# then started again on all the displays in one combined transaction per bus, so the chips on a bus
+# start their blink cycles within microseconds of each other (on different buses, within the time
+# of one transaction). Call it again to bring the group back in step if their clocks drift apart.
+def blinkGroup(displays, slow=False, startOn=True):
+    with I2cBatch(*displays):
+        for display in displays:
+            display.blinkOff()
+        for display in displays:
+            display.blinkOn(slow, startOn, sync=True)
+
+
+# a font for the displays: the segments for every character, and a cache of rendered strings.
+# Characters 0-255 are looked up in a 256 byte table, so a whole string is rendered with one
+# bytes.translate() call. glyphs is a dictionary of extra or replacement characters
+# (like {u'\u00b0': 0b01100011} for a degree sign), characters not in the font are blank.
+class SegmentFont(object):
+
+    def __init__(self, glyphs=None, segments=None, cacheSize=256):
+        if segments is None:
+            segments = I2c7SegmentLed.LedSegments
+        table = bytearray(256)
+        table[0:len(segments)] = bytearray(segments)
+        self._extended = {}             # glyphs for characters above 255
+        if glyphs:
+            for char, value in glyphs.items():
+                if ord(char) < 256:
+                    table[ord(char)] = value
+                else:
+                    self._extended[char] = value
+        table[ord('.')] = 0             # decimal points are folded into the previous digit
+        self._glyphs = table
+        self.table = bytes(table)
+        self.cacheSize = cacheSize
+        self._cache = OrderedDict()     # (text, digits) -> (segments, digits used), oldest first
+        self._lock = threading.Lock()
+
+    # return the segments for one character
+    def glyph(self, char):
+        code = ord(char)
+        if code < 256:
+            return self._glyphs[code]
+        return self._extended.get(char, 0x00)
+
+    # render text for a display with this many digits, returns a tuple of the segments for each digit
+    def render(self, text, digits):
+        return self.compile(text, digits)[0]
+
+    # render text like I2c7SegmentLed.writeString() does on a cleared display. Returns the segments for
+    # each digit and the number of digits used. Recently rendered strings come from the cache.
+    def compile(self, text, digits):
+        key = (text, digits)
+        with self._lock:
+            result = self._cache.pop(key, None)
+            if result is not None:
+                self._cache[key] = result       # move it to the newest end
+                return result
+        result = self._compile(text, digits)
+        with self._lock:
+            self._cache[key] = result
+            if len(self._cache) > self.cacheSize:
+                self._cache.popitem(last=False)
+        return result
+
+    def _compile(self, text, digits):
+        try:
+            data = text.encode("latin-1")
+        except (UnicodeError, AttributeError):
+            data = None
+        frame = bytearray()
+        if data is not None:
+            parts = data.split(b".")
+            frame += bytearray(parts[0].translate(self.table)[:digits])
+            for part in parts[1:]:
+                if len(frame) >= digits:
+                    break               # the cursor is past the last digit, the rest is ignored
+                if frame:
+                    frame[-1] |= I2c7SegmentLed.DECIMAL_POINT_MASK
+                else:
+                    frame.append(I2c7SegmentLed.DECIMAL_POINT_MASK)   # a leading '.' uses the 1st digit
+                frame += bytearray(part.translate(self.table)[:digits-len(frame)])
+        else:
+            for char in text:           # characters above 255, one at a time
+                if len(frame) >= digits:
+                    break
+                if char == ".":
+                    if frame:
+                        frame[-1] |= I2c7SegmentLed.DECIMAL_POINT_MASK
+                    else:
+                        frame.append(I2c7SegmentLed.DECIMAL_POINT_MASK)
+                else:
+                    frame.append(self.glyph(char))
+        used = len(frame)
+        frame += bytearray(digits - used)
+        return tuple(frame), used
+
+
+defaultFont = SegmentFont({u"\u00b0": 0b01100011})     # the LedSegments characters and a degree sign
+
+
+# collect register writes for one or more I2c7SegmentLed displays and send them to the
+# i2c bus as a single combined I2C_RDWR transaction (one syscall instead of one per register).
+# Usage:
+#     with I2cBatch(led1, led2):
+#         led1.show("12.5")
+#         led2.setBrightness(8)
+# Without the smbus2 library the queued writes are sent one at a time when the batch ends.
+class I2cBatch(object):
+
+    def __init__(self, *displays):
+        self._displays = displays
+        self._previous = []
+        self._writes = []           # queued (display, register, value) tuples
+
+    def __enter__(self):
+        self._previous = [display._batch for display in self._displays]
+        for display in self._displays:
+            display._batch = self
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        for display, previous in zip(self._displays, self._previous):
+            display._batch = previous
+        # if we are nested inside another batch, hand our writes to it rather than sending them now
+        writes = self._writes
+        self._writes = []
+        for display, reg, value in writes:
+            if display._batch is not None:
+                display._batch.add(display, reg, value)
+            else:
+                self._writes.append((display, reg, value))
+        self.flush()
+        return False
+
+    # queue a register write
+    def add(self, display, reg, value):
+        self._writes.append((display, reg, value))
+
+    # send all queued writes, one combined transaction per bus, keeping the order of the writes on each bus
+    def flush(self):
+        writes = self._writes
+        self._writes = []
+        buses = []
+        byBus = {}
+        for display, reg, value in writes:
+            key = id(display._bus)
+            if key not in byBus:
+                buses.append(display._bus)
+                byBus[key] = []
+            byBus[key].append((display, reg, value))
+        for bus in buses:
+            busWrites = byBus[id(bus)]
+            enabled = stats.enabled
+            if enabled:
+                started = _monotonic()
+            failed = set(bus.writeBatch([(display._i2cAddress, reg, value) for display, reg, value in busWrites]))
+            if enabled:
+                counts = {}
+                failedDisplays = set()
+                for display, reg, value in busWrites:
+                    counts[display] = counts.get(display, 0) + 1
+                    if (display._i2cAddress, reg, value) in failed:
+                        failedDisplays.add(display)
+                stats.recordBatch(bus, counts, failedDisplays, _monotonic() - started)
+            # one device that doesn't answer aborts the whole combined transaction, so the failed writes
+            # are sent again one at a time (with retries), to find out which displays really failed
+            broken = set()
+            for display, reg, value in busWrites:
+                if (display._i2cAddress, reg, value) not in failed:
+                    continue
+                if display not in broken:
+                    try:
+                        display._transfer(bus.write_byte_data, reg, value)
+                        continue
+                    except I2c7SegmentLedError:
+                        broken.add(display)
+                display._writeFailed(reg)
+
+
+# drive many displays from one refresh loop. New text for any display can be given at any time
+# (from any thread), and every tick sends only the digits that changed, as one combined transaction
+# per bus. Usage:
+#     bank = DisplayBank(frameRate=20)
+#     temperature = bank.add(0x01, 4)
+#     humidity = bank.add(0x02, 4, bus=3)
+#     bank.start()                      # or call bank.tick() from your own loop
+#     bank.show(temperature, "%4.1f" %value)
+class DisplayBank(object):
+
+    # frameRate is the number of ticks per second when running, maxWritesPerBus limits the digit
+    # writes sent to each bus in one tick (None is no limit); displays that don't fit are sent first
+    # on the next tick, and the display that starts each bus rotates every tick so that none is starved
+    def __init__(self, frameRate=20.0, maxWritesPerBus=None):
+        self.frameRate = frameRate
+        self.maxWritesPerBus = maxWritesPerBus
+        self.displays = []
+        self.ticks = 0                  # number of ticks run
+        self.overruns = 0               # ticks that took longer than one frame, or started late
+        self.lastTickTime = 0.0         # seconds taken by the last tick
+        self._pending = {}              # display index -> newest text or segment list
+        self._controls = OrderedDict()  # (display index, key) -> (method name, newest arguments)
+        self._start = 0                 # rotating start position for per bus fairness
+        self._deferred = []             # displays that didn't fit in the last tick, sent first on the next one
+        self._lock = threading.Lock()
+        self._thread = None
+        self._running = False
+        self._addressed = []            # buses on which selfAddressAll() was already done
+
+    # create and add a display, returns its index. The chips on a bus are self addressed once.
+    def add(self, i2cAddress, digits, bus=None, attach=True):
+        bus = getBus(bus)
+        if bus not in self._addressed:
+            selfAddressAll(bus)
+            self._addressed.append(bus)
+        return self.addDisplay(I2c7SegmentLed(i2cAddress, digits, bus, attach=attach, selfAddress=False))
+
+    # add an existing I2c7SegmentLed object, returns its index. The display is put in frame mode,
+    # so digits written to it directly are also sent by the next tick.
+    def addDisplay(self, display):
+        display.beginFrame()
+        with self._lock:
+            self.displays.append(display)
+            return len(self.displays) - 1
+
+    # set the text for a display (by index), it is written on the next tick
+    def show(self, index, text):
+        with self._lock:
+            self._pending[index] = text
+
+    # set the segments for a display (by index, a list of segment values starting at digit 1)
+    def showSegments(self, index, segments):
+        with self._lock:
+            self._pending[index] = list(segments)
+
+    # call an I2c7SegmentLed method (like "setBrightness" or "displayOff") of a display on the next tick,
+    # so that it is sent with the digits. Only the newest call with the same key is made; the key is the
+    # method name unless given, so calls like displayOn and displayOff can share one key and replace each other.
+    def control(self, index, method, args=(), key=None):
+        if key is None:
+            key = method
+        with self._lock:
+            self._controls.pop((index, key), None)
+            self._controls[(index, key)] = (method, args)
+
+    # send the changed digits of all displays, returns the number of digit writes sent
+    def tick(self):
+        started = _monotonic()
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+            controls = self._controls
+            self._controls = OrderedDict()
+            displays = list(self.displays)
+        for index, value in pending.items():
+            if isinstance(value, list):
+                displays[index].showSegments(value)
+            else:
+                displays[index].show(value)
+
+        # choose the displays to send on each bus: the ones deferred by the last tick first, then the
+        # others starting at the rotating position. Offline displays are skipped until their probe is due.
+        count = len(displays)
+        order = [display for display in self._deferred if display in displays]
+        order.extend(display for display in (displays[(self._start + offset) % count] for offset in range(count))
+                     if display not in order)
+        now = _monotonic()
+        chosen = []
+        deferred = []
+        writesPerBus = {}
+        for display in order:
+            if display.offline and now < display._nextProbe:
+                continue
+            changed = len(display.changedDigits())
+            if changed == 0:
+                continue
+            busWrites = writesPerBus.get(id(display._bus), 0)
+            if self.maxWritesPerBus is not None and busWrites > 0 and busWrites + changed > self.maxWritesPerBus:
+                deferred.append(display)    # doesn't fit in this tick, it is sent first on the next tick
+                continue
+            writesPerBus[id(display._bus)] = busWrites + changed
+            chosen.append(display)
+        self._deferred = deferred
+        if count:
+            self._start = (self._start + 1) % count
+
+        batchDisplays = list(chosen)
+        for index, key in controls:
+            if displays[index] not in batchDisplays:
+                batchDisplays.append(displays[index])
+        with I2cBatch(*batchDisplays):
+            for (index, key), (method, args) in controls.items():
+                getattr(displays[index], method)(*args)
+            for display in chosen:
+                display.flush()
+
+        self.ticks += 1
+        self.lastTickTime = _monotonic() - started
+        return sum(writesPerBus.values())
+
+    # run ticks at frameRate until stop() is called (from another thread)
+    def run(self):
+        self._running = True
+        period = 1.0 / self.frameRate
+        nextTick = _monotonic()
+        while self._running:
+            self.tick()
+            nextTick += period
+            now = _monotonic()
+            if now > nextTick:
+                self.overruns += 1
+                nextTick += ((now - nextTick) // period + 1) * period    # skip the frames we missed
+            sleep(max(0.0, nextTick - _monotonic()))
+
+    # start running ticks in a background thread
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    # stop the background thread, after it finished its current tick
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+# one logical display made of several modules side by side, like four 8 digit modules used as one
+# 32 character line. It has one cursor and one set of digits, with the same functions as I2c7SegmentLed,
+# and every change is sent as one combined transaction per bus with only the digits that changed, so all
+# the modules update at the same time. modules is a list of (i2cAddress, digits) or (i2cAddress, digits, bus)
+# tuples (see initializeFleet()), or of I2c7SegmentLed objects, from left to right. Usage:
+#     line = WideDisplay([(0x01, 8), (0x02, 8), (0x03, 4)])
+#     line.writeString("temperature 21.5")
+class WideDisplay(object):
+
+    def __init__(self, modules, bus=None, attach=True, font=None):
+        if modules and not isinstance(modules[0], I2c7SegmentLed):
+            modules = initializeFleet(modules, bus, attach)
+        self.displays = list(modules)
+        self._font = font if font is not None else defaultFont
+        self._map = [None]                  # logical digit -> (display, digit of that display)
+        for display in self.displays:
+            display.beginFrame()            # the modules' digits are only sent by flush()
+            for digit in range(1, display._digits+1):
+                self._map.append((display, digit))
+        self._digits = len(self._map) - 1
+        self._segments = [0] * (self._digits + 1)   # digit 0 is not used
+        for digit in range(1, self._digits+1):
+            display, moduleDigit = self._map[digit]
+            self._segments[digit] = display._segments[moduleDigit]
+        self._cursorPosition = 1
+        self._frameMode = False
+
+    # the total number of digits of all the modules
+    def digits(self):
+        return self._digits
+
+    # send the changed digits of all the modules, as one combined transaction per bus
+    def flush(self):
+        for digit in range(1, self._digits+1):
+            display, moduleDigit = self._map[digit]
+            display._segments[moduleDigit] = self._segments[digit]
+        with I2cBatch(*self.displays):
+            for display in self.displays:
+                display.flush()
+
+    # send the digits now, unless a frame is being built
+    def _update(self):
+        if not self._frameMode:
+            self.flush()
+
+    # call a method on every module, as one combined transaction per bus
+    def _all(self, method, *args):
+        with I2cBatch(*self.displays):
+            for display in self.displays:
+                getattr(display, method)(*args)
+
+    # start a frame: following writes only change the local storage until endFrame() or flush() is called
+    def beginFrame(self):
+        self._frameMode = True
+
+    # end a frame and send the digits that changed to the modules
+    def endFrame(self):
+        self._frameMode = False
+        self.flush()
+
+    # set the font used for characters
+    def setFont(self, font):
+        self._font = font
+
+    def setSegments(self, digit, segments):
+        if (digit <= self._digits) and (digit >= 1):
+            self._segments[digit] = segments
+            self._update()
+
+    # replace the whole line with a string, writing only the digits that changed
+    def show(self, value):
+        segments, used = self._font.compile(value, self._digits)
+        self.showSegments(segments)
+        self._cursorPosition = used + 1
+
+    # replace the whole line with a list of segment values (one per digit, starting at digit 1)
+    def showSegments(self, segments):
+        for digit in range(1, self._digits+1):
+            self._segments[digit] = segments[digit-1] if digit <= len(segments) else 0x00
+        self._cursorPosition = 1
+        self._update()
+
+    # clear all digits of all the modules
+    def clear(self):
+        self._segments = [0] * (self._digits + 1)
+        self._cursorPosition = 1
+        self._update()
+
+    def home(self):
+        self.cursorMove(1)
+
+    def cursorMove(self, digit):
+        if (digit <= self._digits) and (digit >= 1):
+            self._cursorPosition = digit
+
+    def setBrightness(self, value):
+        self._all("setBrightness", value)
+
+    # set the brightness of one digit of the line to value (0-15)
+    def setDigitBrightness(self, digit, value):
+        if (digit <= self._digits) and (digit >= 1):
+            display, moduleDigit = self._map[digit]
+            display.setDigitBrightness(moduleDigit, value)
+
+    def displayOff(self):
+        self._all("displayOff")
+
+    def displayOn(self):
+        self._all("displayOn")
+
+    # make the whole line blink, with the modules blinking in step (see blinkGroup())
+    def blinkOn(self, slow=False, startOn=True):
+        blinkGroup(self.displays, slow, startOn)
+
+    def blinkOff(self):
+        self._all("blinkOff")
+
+    def setDecimalPoint(self, digit):
+        if (digit <= self._digits) and (digit >= 1):
+            self.setSegments(digit, self._segments[digit] | I2c7SegmentLed.DECIMAL_POINT_MASK)
+
+    def clearDecimalPoint(self, digit):
+        if (digit <= self._digits) and (digit >= 1):
+            self.setSegments(digit, self._segments[digit] & ~I2c7SegmentLed.DECIMAL_POINT_MASK)
+
+    # put a character in the local storage, following the same rules as I2c7SegmentLed.write()
+    def _write(self, value):
+        if self._cursorPosition <= self._digits:
+            if value == '.':
+                if self._cursorPosition == 1:
+                    self._segments[1] |= I2c7SegmentLed.DECIMAL_POINT_MASK
+                    self._cursorPosition += 1
+                else:
+                    self._segments[self._cursorPosition-1] |= I2c7SegmentLed.DECIMAL_POINT_MASK
+            else:
+                self._segments[self._cursorPosition] = self._font.glyph(value)
+                self._cursorPosition += 1
+
+    # write an ascii character at the cursor
+    def write(self, value):
+        self._write(value)
+        self._update()
+
+    # write a string across the modules, sent as one update
+    def writeString(self, value):
+        for char in value:
+            self._write(char)
+        self._update()
+
+
+# write frames for one or more displays (for example all the displays on one bus) from a background
+# thread, so that producers never wait for the i2c bus. Only the newest frame posted for each display
+# is written, and at most maxFrameRate times per second. Usage:
+#     refresher = I2cRefresher([led1, led2], maxFrameRate=10)
+#     refresher.start()
+#     refresher.post(led1, "%4.1f" %value)     # returns at once
+class I2cRefresher(object):
+
+    def __init__(self, displays, maxFrameRate=30.0):
+        self.displays = list(displays)
+        self.maxFrameRate = maxFrameRate
+        self.posted = 0                 # frames posted
+        self.written = 0                # frames written to the displays
+        self.dropped = 0                # frames replaced by a newer frame before they were written
+        self.coalesced = 0              # frames written in the same combined transaction as another frame
+        self._pending = {}              # id(display) -> (display, newest text or segment list)
+        self._condition = threading.Condition()
+        self._thread = None
+        self._running = False
+        for display in self.displays:
+            display.beginFrame()        # the refresher does all the writes for its displays
+
+    # post the text for a display, replacing any frame for it that is still waiting to be written
+    def post(self, display, text):
+        self._post(display, text)
+
+    # post a list of segment values (starting at digit 1) for a display
+    def postSegments(self, display, segments):
+        self._post(display, list(segments))
+
+    def _post(self, display, frame):
+        with self._condition:
+            self.posted += 1
+            if id(display) in self._pending:
+                self.dropped += 1
+            self._pending[id(display)] = (display, frame)
+            self._condition.notify()
+
+    # return the frame counters as a dictionary
+    def stats(self):
+        with self._condition:
+            return {"posted": self.posted, "written": self.written,
+                    "dropped": self.dropped, "coalesced": self.coalesced}
+
+    # write the waiting frames now, returns the number of frames written
+    def writePending(self):
+        with self._condition:
+            pending = list(self._pending.values())
+            self._pending = {}
+        for display, frame in pending:
+            if isinstance(frame, list):
+                display.showSegments(frame)
+            else:
+                display.show(frame)
+        with I2cBatch(*[display for display, frame in pending]):
+            for display, frame in pending:
+                display.flush()
+        with self._condition:
+            self.written += len(pending)
+            if len(pending) > 1:
+                self.coalesced += len(pending) - 1
+        return len(pending)
+
+    # write frames as they are posted until stop() is called
+    def run(self):
+        period = 1.0 / self.maxFrameRate
+        nextWrite = _monotonic()
+        while True:
+            with self._condition:
+                while self._running and not self._pending:
+                    self._condition.wait()
+                if not self._running:
+                    break
+            wait = nextWrite - _monotonic()
+            if wait > 0:
+                sleep(wait)             # newer frames posted meanwhile replace the waiting ones
+            self.writePending()
+            nextWrite = max(nextWrite + period, _monotonic())
+
+    # start the background thread
+    def start(self):
+        if self._thread is None:
+            self._running = True
+            self._thread = threading.Thread(target=self.run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    # stop the background thread, writing the frames that are still waiting
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.writePending()
+
+
+# brightness curves for BrightnessFade, mapping the fraction of the fade time (0.0-1.0) to the
+# fraction of the brightness change (0.0-1.0)
+def linearCurve(t):
+    return t
+
+# a curve that changes slowly at low brightness, where the eye notices each step the most
+def gammaCurve(gamma=2.2):
+    return lambda t: t ** gamma
+
+
+# base class for effects run by an EffectScheduler: a display and a list of precomputed frames,
+# each with the time (in seconds from the start of the effect) at which it is written
+class TimedEffect(object):
+
+    kind = "effect"             # a new effect replaces a running one of the same kind on the same display
+
+    def __init__(self, display, times, frames):
+        self.display = display
+        self.times = times
+        self.frames = frames
+        self._start = None
+        self._index = 0
+
+    # start the effect at time now (from _monotonic())
+    def start(self, now):
+        self._start = now
+        self._index = 0
+
+    # the time the next frame is due, or None when the effect has finished
+    def due(self):
+        if self._start is None or self._index >= len(self.frames):
+            return None
+        return self._start + self.times[self._index]
+
+    # write the next frame. When frames are late, the late ones are combined into one (see combine())
+    # so the effect doesn't lag behind its schedule (the last frame is always written).
+    def step(self, now):
+        first = self._index
+        while self._index + 1 < len(self.frames) and self._start + self.times[self._index + 1] <= now:
+            self._index += 1
+        self.apply(self.combine(self.frames[first:self._index+1]))
+        self._index += 1
+
+    # return one frame with the effect of writing all these frames in turn (by default the last one)
+    def combine(self, frames):
+        return frames[-1]
+
+    # write one frame to the display
+    def apply(self, frame):
+        raise NotImplementedError
+
+
+# fade the brightness of a display from start to end (0-15) over duration seconds. With digits
+# (a list of digit numbers) only those digits fade, using the per digit intensity registers, and
+# start and end can also be lists with a value for each of those digits. The register values are
+# worked out once when the fade is created, and each step only writes the registers that change.
+class BrightnessFade(TimedEffect):
+
+    kind = "brightness"
+
+    def __init__(self, display, start, end, duration, digits=None, curve=linearCurve, maxRate=50.0):
+        samples = max(1, int(duration * maxRate))
+        times = []
+        frames = []
+        levels = None
+        previous = dict(display._desired)       # registers that already have the right value are not written
+        if digits is not None:
+            starts = start if isinstance(start, (list, tuple)) else [start] * len(digits)
+            ends = end if isinstance(end, (list, tuple)) else [end] * len(digits)
+            levels = list(display._digitBrightness[1:])
+        for sample in range(samples + 1):
+            fraction = curve(float(sample) / samples)
+            if digits is None:
+                level = int(round(start + (end - start) * fraction))
+                registers = [(I2c7SegmentLed.REG_GLOBAL_INTENSITY, level)]
+                frameLevels = None
+            else:
+                for index, digit in enumerate(digits):
+                    levels[digit-1] = int(round(starts[index] + (ends[index] - starts[index]) * fraction))
+                registers = display.digitBrightnessRegisters(levels)
+                frameLevels = list(levels)
+            writes = [(reg, value) for reg, value in registers if previous.get(reg) != value]
+            if writes:
+                times.append(duration * sample / samples)
+                frames.append((writes, frameLevels))
+                previous.update(writes)
+        TimedEffect.__init__(self, display, times, frames)
+
+    # the frames only hold the registers that changed, so the writes of skipped frames are kept
+    # (the newest value of each register)
+    def combine(self, frames):
+        values = OrderedDict()
+        for writes, levels in frames:
+            for reg, value in writes:
+                values[reg] = value
+        return (list(values.items()), frames[-1][1])
+
+    def apply(self, frame):
+        writes, levels = frame
+        if levels is not None:
+            self.display._digitBrightness[1:len(levels)+1] = levels
+        for reg, value in writes:
+            self.display.setRegister(reg, value)
+
+
+# run timed effects (brightness fades, animations) for many displays on one thread. Frames are due at
+# fixed times from the start of each effect (so there is no drift), and all the frames due at the
+# same time are written in one combined transaction per bus. Usage:
+#     scheduler = EffectScheduler()
+#     scheduler.add(BrightnessFade(led, 15, 2, 1.5))
+class EffectScheduler(object):
+
+    def __init__(self):
+        self._effects = []
+        self._condition = threading.Condition()
+        self._thread = None
+        self._running = False
+
+    # start an effect (starting the scheduler thread if needed). It replaces a running effect
+    # of the same kind on the same display.
+    def add(self, effect):
+        with self._condition:
+            self._effects = [running for running in self._effects
+                             if running.display is not effect.display or running.kind != effect.kind]
+            effect.start(_monotonic())
+            if effect.due() is None:
+                return effect           # no frames to write (like a fade to the brightness it already has)
+            self._effects.append(effect)
+            self._condition.notify()
+        self.start()
+        return effect
+
+    # stop an effect
+    def cancel(self, effect):
+        with self._condition:
+            if effect in self._effects:
+                self._effects.remove(effect)
+
+    # True while the effect is still running
+    def isRunning(self, effect):
+        with self._condition:
+            return effect in self._effects
+
+    # write all the frames that are due, and drop the effects that have finished
+    def runDue(self):
+        now = _monotonic()
+        with self._condition:
+            dueEffects = [effect for effect in self._effects if effect.due() is not None and effect.due() <= now]
+        if dueEffects:
+            with I2cBatch(*[effect.display for effect in dueEffects]):
+                for effect in dueEffects:
+                    effect.step(now)
+        with self._condition:
+            self._effects = [effect for effect in self._effects if effect.due() is not None]
+
+    def run(self):
+        while True:
+            self.runDue()
+            with self._condition:
+                if not self._running:
+                    break
+                # worked out while holding the condition, so an effect added since runDue() isn't missed
+                times = [effect.due() for effect in self._effects if effect.due() is not None]
+                nextDue = min(times) if times else None
+                if nextDue is None:
+                    self._condition.wait()
+                else:
+                    wait = nextDue - _monotonic()
+                    if wait > 0:
+                        self._condition.wait(wait)
+
+    # start the scheduler thread (add() does this)
+    def start(self):
+        with self._condition:
+            if self._thread is not None:
+                return
+            self._running = True
+            self._thread = threading.Thread(target=self.run)
+            self._thread.daemon = True
+        self._thread.start()
+
+    # stop the scheduler thread
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+            thread = self._thread
+            self._thread = None
+        if thread is not None:
+            thread.join()
+
+
+# play a list of segment frames (each a list of segment values starting at digit 1) on a display,
+# one every interval seconds, with an EffectScheduler. Only the digits that differ from the previous
+# frame are written, and frames that are the same as the one before are not sent at all.
+# With loop=True the animation repeats until it is cancelled.
+class Animation(TimedEffect):
+
+    kind = "segments"
+
+    def __init__(self, display, frames, interval, loop=False):
+        times = []
+        keptFrames = []
+        for index, frame in enumerate(frames):
+            frame = tuple(frame)
+            if not keptFrames or frame != keptFrames[-1]:
+                times.append(index * interval)
+                keptFrames.append(frame)
+        TimedEffect.__init__(self, display, times, keptFrames)
+        self.loop = loop and len(keptFrames) > 1
+        self.period = len(frames) * interval
+
+    # an animation showing each of a list of strings in turn
+    @classmethod
+    def fromTexts(cls, display, texts, interval, loop=False):
+        return cls(display, [display._font.render(text, display._digits) for text in texts], interval, loop)
+
+    # an animation scrolling text from right to left across the display, starting and ending blank
+    @classmethod
+    def scroll(cls, display, text, interval=0.3, loop=False):
+        digits = display._digits
+        strip, used = display._font.compile(text, len(text) + 1)
+        strip = (0,) * digits + strip[:used] + (0,) * digits
+        frames = [strip[start:start+digits] for start in range(len(strip) - digits + 1)]
+        return cls(display, frames, interval, loop)
+
+    def step(self, now):
+        TimedEffect.step(self, now)
+        if self.loop and self._index >= len(self.frames):
+            self._start += self.period      # the next cycle starts exactly one period later
+            self._index = 0
+
+    def apply(self, frame):
+        self.display.showSegments(frame)
+        self.display.flush()
+
+
+# a key press or release found by a KeyScanner. key is 0-7 for the KEYA inputs and 8-15 for KEYB.
+class KeyEvent(object):
+
+    def __init__(self, display, key, pressed, time):
+        self.display = display
+        self.key = key
+        self.pressed = pressed
+        self.time = time
+
+    def __repr__(self):
+        return "KeyEvent(0x%02x, key %d, %s)" %(self.display._i2cAddress, self.key, "pressed" if self.pressed else "released")
+
+
+# scan the keys connected to the AS1115 chips of many displays. Each scan reads the REG_KEYA and
+# REG_KEYB registers of all displays with one combined read per bus, and a key change is only
+# reported after it was seen in `debounce` scans in a row. Scans run every minInterval seconds while
+# keys are in use, slowing down to maxInterval when all keys have been idle for idleTime seconds.
+# With useIrq=True the idle scans stop completely, and interrupt() (for example as the callback of
+# a GPIO falling edge on the chips' IRQ line) starts scanning again. Usage:
+#     scanner = KeyScanner([led1, led2], callback=lambda event: print(event))
+#     scanner.start()
+class KeyScanner(object):
+
+    def __init__(self, displays, callback=None, debounce=2, minInterval=0.01, maxInterval=0.1,
+                 idleTime=1.0, useIrq=False):
+        self.displays = list(displays)
+        self.debounce = debounce
+        self.minInterval = minInterval
+        self.maxInterval = maxInterval
+        self.idleTime = idleTime
+        self.useIrq = useIrq
+        self.interval = minInterval         # current time between scans
+        self.scans = 0
+        self._listeners = [callback] if callback is not None else []
+        self._indexes = dict((display, index) for index, display in enumerate(self.displays))
+        self._stable = [0] * len(self.displays)         # debounced key bits of each display (1 = pressed)
+        self._candidate = [None] * len(self.displays)   # new key bits waiting to be confirmed
+        self._count = [0] * len(self.displays)
+        self._lastActivity = _monotonic()
+        self._condition = threading.Condition()
+        self._wake = False
+        self._thread = None
+        self._running = False
+
+    # call callback(event) for every KeyEvent (from the scanner thread)
+    def addListener(self, callback):
+        self._listeners.append(callback)
+
+    def removeListener(self, callback):
+        self._listeners.remove(callback)
+
+    # return the debounced pressed keys of a display as a 16 bit value
+    def pressedKeys(self, display):
+        return self._stable[self._indexes[display]]
+
+    # read the keys of all displays once, returns the list of KeyEvents found
+    def scan(self):
+        now = _monotonic()
+        self.scans += 1
+        events = []
+        busy = False
+        for bus, busDisplays in _byBus([display for display in self.displays if self._online(display)]):
+            indexes = [self._indexes[display] for display in busDisplays]
+            reads = []
+            for display in busDisplays:
+                reads.append((display, I2c7SegmentLed.REG_KEYA))
+                reads.append((display, I2c7SegmentLed.REG_KEYB))
+            values = _readBatch(bus, reads)
+            for position, index in enumerate(indexes):
+                keyA, keyB = values[2*position], values[2*position+1]
+                display = self.displays[index]
+                if keyA is None or keyB is None:
+                    display.errorCount += 1
+                    display._transferResult(False)     # a missing keypad goes offline, so it stops slowing the scans
+                    continue
+                display._transferResult(True)
+                raw = ~(keyA | (keyB << 8)) & 0xffff      # the key inputs read 0 while pressed
+                stable = self._stable[index]
+                if raw != stable or raw:
+                    busy = True
+                if raw == stable:
+                    self._candidate[index] = None
+                    continue
+                if raw != self._candidate[index]:
+                    self._candidate[index] = raw
+                    self._count[index] = 0
+                self._count[index] += 1
+                if self._count[index] < self.debounce:
+                    continue
+                changed = raw ^ stable
+                for key in range(16):
+                    if changed & (1 << key):
+                        events.append(KeyEvent(self.displays[index], key, bool(raw & (1 << key)), now))
+                self._stable[index] = raw
+                self._candidate[index] = None
+
+        # adapt the scan rate to the key activity
+        if busy:
+            self._lastActivity = now
+            self.interval = self.minInterval
+        elif now - self._lastActivity > self.idleTime:
+            self.interval = min(self.maxInterval, self.interval * 2)
+
+        for event in events:
+            for listener in list(self._listeners):
+                try:
+                    listener(event)
+                except Exception:
+                    logger.exception("key event listener failed")
+        return events
+
+    # True if the display's keys should be read: it is online, or offline but due for a probe and answering
+    def _online(self, display):
+        try:
+            display._checkOnline()
+            return True
+        except DisplayOfflineError:
+            return False
+
+    # wake the scanner up at once (for use as the callback of the chips' IRQ line)
+    def interrupt(self, *args):
+        with self._condition:
+            self._wake = True
+            self._lastActivity = _monotonic()
+            self.interval = self.minInterval
+            self._condition.notify()
+
+    def run(self):
+        while True:
+            self.scan()
+            with self._condition:
+                idle = self.useIrq and _monotonic() - self._lastActivity > self.idleTime
+                if not self._wake and self._running:
+                    self._condition.wait(None if idle else self.interval)
+                self._wake = False
+                if not self._running:
+                    break
+
+    # start scanning in a background thread
+    def start(self):
+        if self._thread is None:
+            self._running = True
+            self._thread = threading.Thread(target=self.run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    # stop the scanning thread
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+# the result of runDiagnostics() for one display. openSegments and shortSegments have the faulty
+# segment bits of each digit (index 0 is digit 1), using the same bits as the segment values.
+class DiagnosticReport(object):
+
+    SEGMENT_NAMES = ("G", "F", "E", "D", "C", "B", "A", "DP")    # segment of each bit, from bit 0 to bit 7
+
+    def __init__(self, display):
+        self.display = display
+        self.responded = False          # False if the display was offline or its results couldn't be read
+        self.openSegments = [0] * display._digits
+        self.shortSegments = [0] * display._digits
+        self.rsetOpen = False
+        self.rsetShort = False
+
+    # True if the display answered and no fault was found
+    def ok(self):
+        return self.responded and not self.rsetOpen and not self.rsetShort and \
+            not any(self.openSegments) and not any(self.shortSegments)
+
+    # return a list of (digit, segment name, "open" or "short") tuples for every faulty segment
+    def faults(self):
+        faults = []
+        for kind, digits in (("open", self.openSegments), ("short", self.shortSegments)):
+            for index, bits in enumerate(digits):
+                for bit in range(8):
+                    if bits & (1 << bit):
+                        faults.append((index + 1, DiagnosticReport.SEGMENT_NAMES[bit], kind))
+        return faults
+
+    # return the report as a dictionary (for logging or JSON)
+    def asDict(self):
+        return {"address": self.display._i2cAddress, "bus": self.display._bus.label(),
+                "responded": self.responded, "ok": self.ok(), "rsetOpen": self.rsetOpen,
+                "rsetShort": self.rsetShort, "faults": [list(fault) for fault in self.faults()]}
+
+
+# group displays by bus, keeping their order, returns a list of (bus, displays) pairs
+def _byBus(displays):
+    buses = []
+    groups = {}
+    for display in displays:
+        if id(display._bus) not in groups:
+            groups[id(display._bus)] = []
+            buses.append((display._bus, groups[id(display._bus)]))
+        groups[id(display._bus)].append(display)
+    return buses
+
+
+# run the AS1115 open and/or short segment tests on many displays, and return a DiagnosticReport for
+# each one. Every step is done for all the displays at once (one combined transaction per bus to start
+# a test, one shared wait, one combined read of all the results per bus), and the digits of each
+# display are written back in the same transaction that ends its test, so each display is only
+# disturbed for about the length of the tests.
+def runDiagnostics(displays, tests=("open", "short"), testTime=0.005, timeout=0.1):
+    reports = [DiagnosticReport(display) for display in displays]
+    active = [report for report in reports if not report.display.offline]
+    for report in active:
+        report.responded = True
+    modes = {"open": I2c7SegmentLed.REG_DISPLAY_TEST_MODE_LED_OPEN,
+             "short": I2c7SegmentLed.REG_DISPLAY_TEST_MODE_LED_SHORT}
+    byDisplay = dict((id(report.display), report) for report in active)
+
+    for test in tests:
+        # start the test on all displays
+        with I2cBatch(*[report.display for report in active]):
+            for report in active:
+                report.display.setRegister(I2c7SegmentLed.REG_DISPLAY_TEST_MODE, modes[test])
+
+        # wait until no chip is still testing, then read the results of all displays
+        sleep(testTime)
+        deadline = _monotonic() + timeout
+        for bus, busDisplays in _byBus([report.display for report in active]):
+            while True:
+                states = _readBatch(bus, [(display, I2c7SegmentLed.REG_DISPLAY_TEST_MODE) for display in busDisplays])
+                if _monotonic() > deadline or not any(state is not None and state & I2c7SegmentLed.REG_DISPLAY_TEST_MODE_LED_TEST
+                                                       for state in states):
+                    break
+                sleep(testTime)
+            reads = []
+            for display in busDisplays:
+                reads.extend((display, I2c7SegmentLed.REG_DIAGNOSTIC_DIGIT0 + digit) for digit in range(display._digits))
+            values = _readBatch(bus, reads)
+            position = 0
+            for display, state in zip(busDisplays, states):
+                report = byDisplay[id(display)]
+                results = values[position:position+display._digits]
+                position += display._digits
+                if state is None or None in results or state & I2c7SegmentLed.REG_DISPLAY_TEST_MODE_LED_TEST:
+                    report.responded = False
+                    continue
+                report.rsetOpen = report.rsetOpen or bool(state & I2c7SegmentLed.REG_DISPLAY_TEST_MODE_RSET_OPEN)
+                report.rsetShort = report.rsetShort or bool(state & I2c7SegmentLed.REG_DISPLAY_TEST_MODE_RSET_SHORT)
+                target = report.openSegments if test == "open" else report.shortSegments
+                for digit, bits in enumerate(results):
+                    target[digit] |= bits
+
+    # end the tests and write the digits back
+    with I2cBatch(*[report.display for report in active]):
+        for report in active:
+            display = report.display
+            display.setRegister(I2c7SegmentLed.REG_DISPLAY_TEST_MODE, 0)
+            display._shown = [None] * len(display._shown)
+            display.flush()
+    return reports
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+'''
+    I2c7SegmentLedAsync.py - asyncio interface for the I2c7SegmentLed library
+
+    Short Description:
+
+        This file lets asyncio programs use 7 Segment LED displays without blocking
+        their event loop. The i2c transactions of each bus run on that bus's own small
+        thread pool, and the 20 ms settling delays of the AS1115 self addressing use
+        asyncio.sleep(), so many displays can be initialized at the same time.
+
+        Requires Python 3.5 or later.
+
+    Example:
+
+        import asyncio
+        from I2c7SegmentLedAsync import AsyncI2c7SegmentLed
+
+        async def main():
+            leds = await asyncio.gather(*[AsyncI2c7SegmentLed.create(address, 4) for address in (1, 2, 3)])
+            await leds[0].show("12.5")
+            await leds[1].setBrightness(8)
+
+        asyncio.get_event_loop().run_until_complete(main())
+
+
+    License Information:  https://www.dcity.org/license-information/
+
+'''
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from I2c7SegmentLed import I2c7SegmentLed, getBus, _recorded
+
+
+MAX_WORKERS_PER_BUS = 1     # threads doing i2c transactions for each bus (the bus lock serialises them anyway)
+
+_executors = {}             # id(bus) -> (bus, ThreadPoolExecutor)
+_addressing = {}            # id(bus) -> self addressing task that is running on that bus
+
+
+# return the thread pool used for the transactions on this bus
+def busExecutor(bus):
+    entry = _executors.get(id(bus))
+    if entry is None:
+        entry = (bus, ThreadPoolExecutor(max_workers=MAX_WORKERS_PER_BUS))
+        _executors[id(bus)] = entry
+    return entry[1]
+
+
+# run a blocking function for a bus on the bus's thread pool
+async def runOnBus(bus, function, *args, **kwargs):
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(busExecutor(bus), functools.partial(function, *args, **kwargs))
+
+
+async def _selfAddressAll(bus):
+    # Start talking to the AS1115 chips, as they will be at i2c address 0 initially (upon powerup)
+    try:
+        await runOnBus(bus, _recorded, bus, bus.write_byte_data, 0x00, I2c7SegmentLed.REG_SHUTDOWN, I2c7SegmentLed.REG_SHUTDOWN_NORMAL)
+    except (IOError, OSError):
+        return      # an error just means that the i2c led displays have already had their address set
+    await asyncio.sleep(0.020)
+
+    # tell all AS1115 chips to use their hardware jumpered i2c address
+    try:
+        await runOnBus(bus, _recorded, bus, bus.write_byte_data, 0x00, I2c7SegmentLed.REG_SELF_ADDRESSING, I2c7SegmentLed.REG_SELF_ADDRESSING_USER_ADDRESS)
+    except (IOError, OSError):
+        pass
+    await asyncio.sleep(0.020)
+
+
+# the asyncio version of I2c7SegmentLed.selfAddressAll(). Displays being created at the same
+# time on the same bus share one self addressing sequence.
+async def selfAddressAll(bus=None):
+    bus = getBus(bus)
+    task = _addressing.get(id(bus))
+    if task is None:
+        task = asyncio.ensure_future(_selfAddressAll(bus))
+        _addressing[id(bus)] = task
+        task.add_done_callback(lambda done: _addressing.pop(id(bus), None))
+    await asyncio.shield(task)
+
+
+# asyncio wrapper for an I2c7SegmentLed display. Create it with
+#     led = await AsyncI2c7SegmentLed.create(i2cAddress, digits)
+# The blocking I2c7SegmentLed object is available as led.display.
+class AsyncI2c7SegmentLed(object):
+
+    def __init__(self, display):
+        self.display = display
+
+    # create and initialize a display (see I2c7SegmentLed for the arguments)
+    @classmethod
+    async def create(cls, i2cAddress, digits, bus=None, attach=False):
+        led = cls(I2c7SegmentLed(i2cAddress, digits, bus, configure=False))
+        if attach and await led._run(led.display.attach):
+            return led                  # the chip was already configured, nothing else to do
+        await selfAddressAll(led.display._bus)
+        await led.initialize()
+        return led
+
+    def _run(self, function, *args):
+        return runOnBus(self.display._bus, function, *args)
+
+    # power up, reset and configure the chip, and clear the display
+    async def initialize(self):
+        await self._run(self.display.initialize)
+
+    # replace the whole display with a string, writing only the digits that changed
+    async def show(self, value):
+        await self._run(self.display.show, value)
+
+    # replace the whole display with a list of segment values, writing only the digits that changed
+    async def showSegments(self, segments):
+        await self._run(self.display.showSegments, segments)
+
+    async def writeString(self, value):
+        await self._run(self.display.writeString, value)
+
+    async def clear(self):
+        await self._run(self.display.clear)
+
+    async def setSegments(self, digit, segments):
+        await self._run(self.display.setSegments, digit, segments)
+
+    async def setBrightness(self, value):
+        await self._run(self.display.setBrightness, value)
+
+    async def displayOn(self):
+        await self._run(self.display.displayOn)
+
+    async def displayOff(self):
+        await self._run(self.display.displayOff)
+
+    async def setDecimalPoint(self, digit):
+        await self._run(self.display.setDecimalPoint, digit)
+
+    async def clearDecimalPoint(self, digit):
+        await self._run(self.display.clearDecimalPoint, digit)
+
+    async def setRegister(self, reg, value):
+        return await self._run(self.display.setRegister, reg, value)
+
+    async def getRegister(self, reg):
+        return await self._run(self.display.getRegister, reg)
+
+    # moving the cursor doesn't use the bus, so these don't need to be awaited
+    def home(self):
+        self.display.home()
+
+    def cursorMove(self, digit):
+        self.display.cursorMove(digit)
+
+
+# the KeyEvents of a KeyScanner as an asyncio iterator. Create it from the event loop's thread:
+#     async for event in KeyEventStream(scanner):
+#         print(event.key, event.pressed)
+class KeyEventStream(object):
+
+    def __init__(self, scanner):
+        self._scanner = scanner
+        self._loop = asyncio.get_event_loop()
+        self._queue = asyncio.Queue()
+        scanner.addListener(self._onEvent)
+
+    # called from the scanner thread
+    def _onEvent(self, event):
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, event)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self._queue.get()
+
+    # stop receiving events
+    def close(self):
+        self._scanner.removeListener(self._onEvent)
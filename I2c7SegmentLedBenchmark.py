@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+'''
+    I2c7SegmentLedBenchmark.py
+
+    Short Description:
+
+        Benchmarks for the I2c7SegmentLed library. They run against the simulated
+        AS1115 chips and i2c bus in I2c7SegmentLedSim.py, so no Raspberry Pi or
+        displays are needed.
+
+        For each public call (constructor, writeString, clear + writeString, show,
+        setDecimalPoint, and a refresh of a whole fleet of displays) and for
+        1-8 digits and 1-64 displays, it reports the i2c transactions, messages and
+        bytes per call, the wall time per call, and the bus time per call estimated
+        from the simulated transaction latency and bus speed.
+
+        The results can also be saved as JSON (--json results.json) and compared
+        with the results of an earlier release (--compare old.json), which exits
+        with an error if any number of transactions went up.
+
+    Usage:
+
+        python I2c7SegmentLedBenchmark.py
+        python I2c7SegmentLedBenchmark.py --quick --json results.json
+        python I2c7SegmentLedBenchmark.py --compare results.json
+
+
+    License Information:  https://www.dcity.org/license-information/
+
+'''
+
+import argparse
+import json
+import platform
+import sys
+import time
+
+from I2c7SegmentLed import I2c7SegmentLed, DisplayBank, initializeFleet
+from I2c7SegmentLedSim import SimulatedI2cBus
+
+_clock = getattr(time, "perf_counter", time.time)
+
+LATENCY = 0.00005           # default simulated time for each transaction (syscall and bus turnaround)
+BYTE_TIME = 0.00009         # default simulated time for each byte (9 bits at 100 kHz)
+
+
+# create a simulated bus with displays at addresses 1..count
+def makeBus(count, latency, byteTime):
+    bus = SimulatedI2cBus(latency=latency, byteTime=byteTime, realTime=False)
+    for address in range(1, count + 1):
+        bus.addDevice(address)
+    return bus
+
+
+# a text for frame n that fills the digits, changing like a counter does
+def frameText(n, digits):
+    return ("%0*d" %(digits, n))[-digits:]
+
+
+# run operation(n) iterations times and return the cost of one call
+def measure(bus, iterations, operation):
+    bus.resetCounters()
+    started = _clock()
+    for n in range(iterations):
+        operation(n)
+    wall = _clock() - started
+    return {
+        "iterations": iterations,
+        "transactionsPerCall": float(bus.transactions) / iterations,
+        "messagesPerCall": float(bus.messages) / iterations,
+        "bytesPerCall": float(bus.bytesWritten + bus.bytesRead) / iterations,
+        "wallSecondsPerCall": wall / iterations,
+        "busSecondsPerCall": bus.busyTime / iterations,
+    }
+
+
+def runDisplayCases(digits, iterations, latency, byteTime):
+    results = []
+
+    def add(case, result):
+        result.update({"case": case, "digits": digits, "displays": 1})
+        results.append(result)
+
+    bus = makeBus(1, latency, byteTime)
+    device = bus.device(1)
+
+    # the constructor on a chip that just powered up (includes the 40 ms self addressing sleeps)
+    def construct(n):
+        device.powerLoss()
+        I2c7SegmentLed(1, digits, bus)
+    add("constructor", measure(bus, max(1, iterations // 100), construct))
+
+    # the constructor on a chip that is already running, in attach mode
+    add("constructor attach", measure(bus, iterations, lambda n: I2c7SegmentLed(1, digits, bus, attach=True)))
+
+    led = I2c7SegmentLed(1, digits, bus)
+
+    def writeString(n):
+        led.home()
+        led.writeString(frameText(n, digits))
+    add("writeString", measure(bus, iterations, writeString))
+
+    def clearWriteString(n):
+        led.clear()
+        led.writeString(frameText(n, digits))
+    add("clear+writeString", measure(bus, iterations, clearWriteString))
+
+    add("show", measure(bus, iterations, lambda n: led.show(frameText(n, digits))))
+
+    def setDecimalPoint(n):
+        led.setDecimalPoint(n % digits + 1)
+        led.clearDecimalPoint(n % digits + 1)
+    add("setDecimalPoint+clearDecimalPoint", measure(bus, iterations, setDecimalPoint))
+    return results
+
+
+def runFleetCases(count, digits, iterations, latency, byteTime):
+    results = []
+
+    def add(case, result):
+        result.update({"case": case, "digits": digits, "displays": count})
+        results.append(result)
+
+    bus = makeBus(count, latency, byteTime)
+    displays = initializeFleet([(address, digits) for address in range(1, count + 1)], bus)
+
+    # every display updated on its own, the way the demo program does it
+    def refreshEach(n):
+        for index, led in enumerate(displays):
+            led.clear()
+            led.writeString(frameText(n + index, digits))
+    add("fleet clear+writeString", measure(bus, iterations, refreshEach))
+
+    bank = DisplayBank()
+    for led in displays:
+        bank.addDisplay(led)
+
+    def refreshBank(n):
+        for index in range(count):
+            bank.show(index, frameText(n + index, digits))
+        bank.tick()
+    add("fleet DisplayBank tick", measure(bus, iterations, refreshBank))
+    return results
+
+
+def run(quick, latency, byteTime):
+    iterations = 200 if quick else 2000
+    fleetIterations = 20 if quick else 200
+    results = []
+    for digits in range(1, 9):
+        results.extend(runDisplayCases(digits, iterations, latency, byteTime))
+    for count in (1, 4, 16, 64):
+        for digits in ((4, 8) if quick else range(1, 9)):
+            results.extend(runFleetCases(count, digits, fleetIterations, latency, byteTime))
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "latency": latency,
+        "byteTime": byteTime,
+        "results": results,
+    }
+
+
+def printResults(report):
+    print("%-34s %6s %8s %12s %12s %14s %14s" %("case", "digits", "displays", "transactions",
+                                                "bytes", "wall us", "bus us"))
+    for result in report["results"]:
+        print("%-34s %6d %8d %12.2f %12.2f %14.1f %14.1f" %(result["case"], result["digits"], result["displays"],
+                                                           result["transactionsPerCall"], result["bytesPerCall"],
+                                                           result["wallSecondsPerCall"] * 1e6,
+                                                           result["busSecondsPerCall"] * 1e6))
+
+
+# compare the transactions per call with an earlier report, returns the list of regressions
+def compare(report, baseline):
+    key = lambda result: (result["case"], result["digits"], result["displays"])
+    old = dict((key(result), result) for result in baseline["results"])
+    regressions = []
+    for result in report["results"]:
+        previous = old.get(key(result))
+        if previous is not None and result["transactionsPerCall"] > previous["transactionsPerCall"] + 1e-9:
+            regressions.append("%s, %d digits, %d displays: %.2f transactions per call, was %.2f"
+                               %(key(result) + (result["transactionsPerCall"], previous["transactionsPerCall"])))
+    return regressions
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="I2c7SegmentLed benchmarks on simulated AS1115 displays")
+    parser.add_argument("--quick", action="store_true", help="fewer iterations and fleet sizes")
+    parser.add_argument("--json", metavar="FILE", help="save the results as JSON")
+    parser.add_argument("--compare", metavar="FILE", help="compare with results saved by an earlier run")
+    parser.add_argument("--latency", type=float, default=LATENCY, help="simulated seconds per transaction")
+    parser.add_argument("--byte-time", type=float, default=BYTE_TIME, help="simulated seconds per byte")
+    args = parser.parse_args()
+
+    report = run(args.quick, args.latency, args.byte_time)
+    printResults(report)
+
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as baselineFile:
+            regressions = compare(report, json.load(baselineFile))
+        for regression in regressions:
+            print("REGRESSION: " + regression)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+
+'''
+    I2c7SegmentLedDaemon.py - display daemon and client for sharing 7 Segment LEDs between programs
+
+    Short Description:
+
+        The daemon is the only program that talks to the i2c buses. It attaches to its
+        displays once (without resetting or clearing them), and any number of programs
+        can then update the displays by sending small messages to its Unix domain socket.
+        Updates for the same display are combined, and the daemon writes only the digits
+        that changed, at a fixed frame rate (see DisplayBank in I2c7SegmentLed.py).
+
+        I2c7SegmentLedClient has the same functions as I2c7SegmentLed, but sends its
+        updates to the daemon instead of using the i2c bus.
+
+    Starting the daemon (bus:address:digits for each display):
+
+        python I2c7SegmentLedDaemon.py --display 1:0x03:4 --display 1:0x02:8
+        python I2c7SegmentLedDaemon.py --display 1:0x03:4 --simulate    (no hardware needed)
+
+    Using a display from another program:
+
+        from I2c7SegmentLedDaemon import I2c7SegmentLedClient
+        led = I2c7SegmentLedClient(0x03, 4)
+        led.clear()
+        led.writeString("12.5")
+
+    Message format (one Unix datagram per message):
+
+        byte 0: operation (OP_ values below), byte 1: i2c bus number, byte 2: i2c address,
+        then the data for the operation:
+            OP_TEXT              text (utf-8)
+            OP_SEGMENTS          one segment byte for each digit, starting at digit 1
+            OP_BRIGHTNESS        brightness (0-15)
+            OP_DIGIT_BRIGHTNESS  digit, brightness (0-15)
+            OP_POWER             1 for on, 0 for off
+            OP_BLINK             bit 0 blink on, bit 1 slow, bit 2 start on, bit 3 sync
+
+        There is no operation for writing other registers: the daemon keeps track of what each
+        display shows and how it is set up, and raw register writes would go around that.
+
+
+    License Information:  https://www.dcity.org/license-information/
+
+'''
+
+import argparse
+import errno
+import logging
+import os
+import socket
+import struct
+import threading
+
+from I2c7SegmentLed import I2c7SegmentLed, DisplayBank, defaultFont, getBus
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET = "/tmp/I2c7SegmentLed.sock"
+
+OP_TEXT = 1
+OP_SEGMENTS = 2
+OP_BRIGHTNESS = 3
+OP_DIGIT_BRIGHTNESS = 4
+OP_POWER = 5
+OP_BLINK = 6
+
+BLINK_ON = 0x01
+BLINK_SLOW = 0x02
+BLINK_START_ON = 0x04
+BLINK_SYNC = 0x08
+
+_HEADER = struct.Struct("BBB")      # operation, bus, address
+
+
+# the daemon: owns the displays and writes the updates sent to its socket
+class DisplayDaemon(object):
+
+    def __init__(self, socketPath=DEFAULT_SOCKET, frameRate=30.0):
+        self.socketPath = socketPath
+        self.bank = DisplayBank(frameRate)
+        self.messages = 0               # messages received
+        self.badMessages = 0            # messages that were malformed or for unknown displays
+        self._indexes = {}              # (bus number, address) -> display index in the bank
+        self._socket = None
+        self._thread = None
+        self._running = False
+
+    # add a display. bus is the i2c bus number used by clients, busObject an I2cBus to use
+    # instead of the real bus (for example a SimulatedI2cBus)
+    def addDisplay(self, bus, i2cAddress, digits, busObject=None):
+        index = self.bank.add(i2cAddress, digits, busObject if busObject is not None else getBus(bus))
+        self._indexes[(bus, i2cAddress)] = index
+        return index
+
+    # handle one message, returns False if it was not understood
+    def handle(self, message):
+        self.messages += 1
+        if len(message) < _HEADER.size:
+            self.badMessages += 1
+            return False
+        op, bus, address = _HEADER.unpack(message[:_HEADER.size])
+        data = bytearray(message[_HEADER.size:])
+        index = self._indexes.get((bus, address))
+        if index is None:
+            logger.debug("message for unknown display %d:0x%02x", bus, address)
+            self.badMessages += 1
+            return False
+        bank = self.bank
+        if op == OP_TEXT:
+            bank.show(index, bytes(data).decode("utf-8", "replace"))
+        elif op == OP_SEGMENTS:
+            bank.showSegments(index, list(data))
+        elif op == OP_BRIGHTNESS and len(data) == 1:
+            bank.control(index, "setBrightness", (data[0],))
+        elif op == OP_DIGIT_BRIGHTNESS and len(data) == 2:
+            bank.control(index, "setDigitBrightness", (data[0], data[1]), key=("digit brightness", data[0]))
+        elif op == OP_POWER and len(data) == 1:
+            bank.control(index, "displayOn" if data[0] else "displayOff", key="power")
+        elif op == OP_BLINK and len(data) == 1:
+            flags = data[0]
+            if flags & BLINK_ON:
+                bank.control(index, "blinkOn", (bool(flags & BLINK_SLOW), bool(flags & BLINK_START_ON),
+                                                 bool(flags & BLINK_SYNC)), key="blink")
+            else:
+                bank.control(index, "blinkOff", key="blink")
+        else:
+            self.badMessages += 1
+            return False
+        return True
+
+    # open the socket (removing a socket file left by an earlier daemon)
+    def open(self):
+        try:
+            os.unlink(self.socketPath)
+        except OSError as error:
+            if error.errno != errno.ENOENT:
+                raise
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._socket.bind(self.socketPath)
+        self._socket.settimeout(0.5)
+
+    # receive and handle messages until stop() is called, while the bank writes the displays
+    def serve(self):
+        if self._socket is None:
+            self.open()
+        self._running = True
+        self.bank.start()
+        try:
+            while self._running:
+                try:
+                    message = self._socket.recv(4096)
+                except socket.timeout:
+                    continue
+                self.handle(message)
+        finally:
+            self.bank.stop()
+            self._socket.close()
+            self._socket = None
+            try:
+                os.unlink(self.socketPath)
+            except OSError:
+                pass
+
+    # serve in a background thread
+    def start(self):
+        if self._thread is None:
+            self.open()
+            self._thread = threading.Thread(target=self.serve)
+            self._thread.daemon = True
+            self._thread.start()
+
+    # stop serving (the displays keep showing what they show)
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+# a display used through the daemon, with the same functions as I2c7SegmentLed (except the raw register
+# functions, see the message format above). The digits are kept here, and every call that changes them
+# sends the whole display in one message, so the daemon always has the newest contents even when other
+# programs write the same display.
+class I2c7SegmentLedClient(object):
+
+    def __init__(self, i2cAddress, digits, bus=1, socketPath=DEFAULT_SOCKET, font=None):
+        self._i2cAddress = i2cAddress
+        self._digits = digits
+        self._bus = bus
+        self._font = font if font is not None else defaultFont
+        self._segments = [0] * (digits + 1)     # digit 0 is not used, like in I2c7SegmentLed
+        self._cursorPosition = 1
+        self._socketPath = socketPath
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+
+    def _send(self, op, data=b""):
+        try:
+            self._socket.sendto(_HEADER.pack(op, self._bus, self._i2cAddress) + bytes(bytearray(data)), self._socketPath)
+            return True
+        except (IOError, OSError) as error:
+            logger.warning("can't send to the display daemon at %s: %s", self._socketPath, error)
+            return False
+
+    def _sendSegments(self):
+        return self._send(OP_SEGMENTS, self._segments[1:])
+
+    # close the connection to the daemon
+    def close(self):
+        self._socket.close()
+
+    def setSegments(self, digit, segments):
+        if (digit <= self._digits) and (digit >= 1):
+            self._segments[digit] = segments
+            self._sendSegments()
+
+    def show(self, value):
+        segments, used = self._font.compile(value, self._digits)
+        self._segments[1:] = segments
+        self._cursorPosition = used + 1
+        self._sendSegments()
+
+    def showSegments(self, segments):
+        self._segments[1:] = [segments[digit] if digit < len(segments) else 0x00 for digit in range(self._digits)]
+        self._cursorPosition = 1
+        self._sendSegments()
+
+    def setBrightness(self, value):
+        self._send(OP_BRIGHTNESS, [value])
+
+    def setDigitBrightness(self, digit, value):
+        self._send(OP_DIGIT_BRIGHTNESS, [digit, value])
+
+    def clear(self):
+        self._segments = [0] * (self._digits + 1)
+        self._cursorPosition = 1
+        self._sendSegments()
+
+    def home(self):
+        self.cursorMove(1)
+
+    def cursorMove(self, digit):
+        if (digit <= self._digits) and (digit >= 1):
+            self._cursorPosition = digit
+
+    def displayOff(self):
+        self._send(OP_POWER, [0])
+
+    def displayOn(self):
+        self._send(OP_POWER, [1])
+
+    def blinkOn(self, slow=False, startOn=True, sync=False):
+        self._send(OP_BLINK, [BLINK_ON | (BLINK_SLOW if slow else 0) | (BLINK_START_ON if startOn else 0) |
+                              (BLINK_SYNC if sync else 0)])
+
+    def blinkOff(self):
+        self._send(OP_BLINK, [0])
+
+    def setDecimalPoint(self, digit):
+        if (digit <= self._digits) and (digit >= 1):
+            self.setSegments(digit, self._segments[digit] | I2c7SegmentLed.DECIMAL_POINT_MASK)
+
+    def clearDecimalPoint(self, digit):
+        if (digit <= self._digits) and (digit >= 1):
+            self.setSegments(digit, self._segments[digit] & ~I2c7SegmentLed.DECIMAL_POINT_MASK)
+
+    # put a character in the local digits, following the same rules as I2c7SegmentLed.write()
+    def _write(self, value):
+        if self._cursorPosition <= self._digits:
+            if value == '.':
+                if self._cursorPosition == 1:
+                    self._segments[1] |= I2c7SegmentLed.DECIMAL_POINT_MASK
+                    self._cursorPosition += 1
+                else:
+                    self._segments[self._cursorPosition-1] |= I2c7SegmentLed.DECIMAL_POINT_MASK
+            else:
+                self._segments[self._cursorPosition] = self._font.glyph(value)
+                self._cursorPosition += 1
+
+    def write(self, value):
+        self._write(value)
+        self._sendSegments()
+
+    # the whole string is sent in one message
+    def writeString(self, value):
+        for char in value:
+            self._write(char)
+        self._sendSegments()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="I2c7SegmentLed display daemon")
+    parser.add_argument("--display", action="append", required=True, metavar="BUS:ADDRESS:DIGITS",
+                        help="a display to manage, like 1:0x03:4 (can be given many times)")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help="path of the Unix domain socket")
+    parser.add_argument("--frame-rate", type=float, default=30.0, help="display updates per second")
+    parser.add_argument("--simulate", action="store_true", help="use simulated displays instead of the i2c buses")
+    parser.add_argument("--verbose", action="store_true", help="log debug messages")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+
+    daemon = DisplayDaemon(args.socket, args.frame_rate)
+    simulatedBuses = {}
+    for spec in args.display:
+        bus, address, digits = [int(part, 0) for part in spec.split(":")]
+        busObject = None
+        if args.simulate:
+            from I2c7SegmentLedSim import SimulatedI2cBus
+            busObject = simulatedBuses.setdefault(bus, SimulatedI2cBus())
+            busObject.addDevice(address)
+        daemon.addDisplay(bus, address, digits, busObject)
+        logger.info("managing display %d:0x%02x with %d digits", bus, address, digits)
+
+    logger.info("listening on %s", args.socket)
+    try:
+        daemon.serve()
+    except KeyboardInterrupt:
+        pass
@@ -216,3 +216,14 @@ if __name__ == "__main__":
             sleep(1)
             led.clearDecimalPoint(3)       # clear the dp on the 1st digit
             sleep(1)
+
+        # test the blink commands (the AS1115 chip does the blinking by itself)
+        led.clear()
+        led.writeString("BLNK")
+        for i in range(0,TESTNUM):
+            led.blinkOn()                 # blink once a second
+            sleep(3)
+            led.blinkOn(slow=True)        # blink once every 2 seconds
+            sleep(4)
+            led.blinkOff()
+            sleep(1)
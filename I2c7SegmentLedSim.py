@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+
+'''
+    I2c7SegmentLedSim.py - simulated AS1115 chips and i2c bus for the I2c7SegmentLed library
+
+    Short Description:
+
+        This file provides an in-process i2c bus backend with simulated AMS AS1115 chips,
+        so that the I2c7SegmentLed library can be imported, tested and benchmarked
+        on a computer without an i2c bus or any 7 Segment LED modules attached.
+
+        The simulated chips model the AS1115 register map (shutdown, self addressing,
+        digit registers, feature, key scan and diagnostic registers).
+        The simulated bus counts transactions and bytes, can add a delay to every
+        transaction and can inject errors (missing devices, random or counted failures).
+
+    Example:
+
+        from I2c7SegmentLed import I2c7SegmentLed
+        from I2c7SegmentLedSim import SimulatedI2cBus
+
+        bus = SimulatedI2cBus()
+        bus.addDevice(0x03)
+        led = I2c7SegmentLed(0x03, 4, bus)
+        led.show("12.5")
+        print(bus.device(0x03).text())      # shows "12.5"
+        print(bus.transactions)
+
+
+    License Information:  https://www.dcity.org/license-information/
+
+'''
+
+import errno
+import random
+import time
+
+from I2c7SegmentLed import I2c7SegmentLed, I2cBus
+
+
+# segment pattern to character, preferring digits, then letters, then the other printable characters
+_characters = {}
+for _code in list(range(48, 58)) + list(range(65, 91)) + list(range(97, 123)) + list(range(33, 128)):
+    _characters.setdefault(I2c7SegmentLed.LedSegments[_code], chr(_code))
+
+
+# a simulated AS1115 chip
+class SimulatedAS1115(object):
+
+    FACTORY_ADDRESS = 0x00          # i2c address of every AS1115 after power up
+
+    # userAddress is the address set by the jumpers, used after self addressing is enabled
+    def __init__(self, userAddress):
+        self.userAddress = userAddress
+        self.connected = True           # set to False to simulate an unplugged module
+        self.openSegments = [0] * 8     # segment bits (DP A B C D E F G, from bit 7 to bit 0) of open LEDs, for each digit
+        self.shortSegments = [0] * 8    # segment bits of shorted LEDs, for each digit
+        self.keys = 0                   # bits of the pressed keys, KEYA is bits 0-7 and KEYB is bits 8-15
+        self.powerUp()
+
+    # put the chip in its power up state (factory address, shutdown, registers cleared)
+    def powerUp(self):
+        self.registers = [0] * 0x30
+        self.address = SimulatedAS1115.FACTORY_ADDRESS
+
+    # simulate a power loss followed by power coming back
+    def powerLoss(self):
+        self.powerUp()
+
+    # reset the control registers, as done by the REG_FEATURE_RESET bit
+    def _resetControlRegisters(self):
+        for reg in (I2c7SegmentLed.REG_DECODE_MODE, I2c7SegmentLed.REG_GLOBAL_INTENSITY,
+                    I2c7SegmentLed.REG_SCAN_LIMIT, I2c7SegmentLed.REG_FEATURE,
+                    I2c7SegmentLed.REG_DISPLAY_TEST_MODE):
+            self.registers[reg] = 0
+        self.registers[I2c7SegmentLed.REG_SHUTDOWN] &= 0x01
+
+    # handle a register write from the bus
+    def write(self, reg, value):
+        if reg >= len(self.registers):
+            raise IOError(errno.EREMOTEIO, "invalid AS1115 register 0x%02x" %reg)
+        if reg == I2c7SegmentLed.REG_SHUTDOWN:
+            self.registers[reg] = value & 0x81
+            if not value & 0x80:                        # bit 7 clear resets the feature register
+                self.registers[I2c7SegmentLed.REG_FEATURE] = 0
+        elif reg == I2c7SegmentLed.REG_FEATURE:
+            if value & I2c7SegmentLed.REG_FEATURE_RESET:
+                self._resetControlRegisters()           # the reset bit clears itself
+            else:
+                self.registers[reg] = value
+        elif reg == I2c7SegmentLed.REG_SELF_ADDRESSING:
+            self.registers[reg] = value & 0x01
+            if value & I2c7SegmentLed.REG_SELF_ADDRESSING_USER_ADDRESS:
+                self.address = self.userAddress
+            else:
+                self.address = SimulatedAS1115.FACTORY_ADDRESS
+        elif reg == I2c7SegmentLed.REG_DISPLAY_TEST_MODE:
+            self.registers[reg] = value & I2c7SegmentLed.REG_DISPLAY_TEST_MODE_OPTICAL
+            if value & (I2c7SegmentLed.REG_DISPLAY_TEST_MODE_LED_SHORT | I2c7SegmentLed.REG_DISPLAY_TEST_MODE_LED_OPEN):
+                self._runLedTest(value)
+        elif I2c7SegmentLed.REG_DIAGNOSTIC_DIGIT0 <= reg <= I2c7SegmentLed.REG_KEYB:
+            pass                                        # read only registers
+        else:
+            self.registers[reg] = value
+
+    # the open/short test finishes instantly, leaving its results in the diagnostic registers
+    def _runLedTest(self, value):
+        found = False
+        for digit in range(8):
+            faults = 0
+            if value & I2c7SegmentLed.REG_DISPLAY_TEST_MODE_LED_OPEN:
+                faults |= self.openSegments[digit]
+            if value & I2c7SegmentLed.REG_DISPLAY_TEST_MODE_LED_SHORT:
+                faults |= self.shortSegments[digit]
+            self.registers[I2c7SegmentLed.REG_DIAGNOSTIC_DIGIT0 + digit] = faults
+            found = found or faults != 0
+        if found:
+            self.registers[I2c7SegmentLed.REG_DISPLAY_TEST_MODE] |= I2c7SegmentLed.REG_DISPLAY_TEST_MODE_LED_GLOBAL
+
+    # handle a register read from the bus
+    def read(self, reg):
+        if reg >= len(self.registers):
+            raise IOError(errno.EREMOTEIO, "invalid AS1115 register 0x%02x" %reg)
+        if reg == I2c7SegmentLed.REG_KEYA:
+            return ~self.keys & 0xff                    # key inputs read 0 while pressed
+        if reg == I2c7SegmentLed.REG_KEYB:
+            return ~(self.keys >> 8) & 0xff
+        return self.registers[reg]
+
+    # press or release a key (0-15)
+    def setKey(self, key, pressed=True):
+        if pressed:
+            self.keys |= 1 << key
+        else:
+            self.keys &= ~(1 << key)
+
+    # True if the chip is running (not shut down)
+    def isOn(self):
+        return bool(self.registers[I2c7SegmentLed.REG_SHUTDOWN] & 0x01)
+
+    # segments currently stored for digits 1..digits
+    def segments(self, digits=8):
+        return self.registers[1:digits+1]
+
+    # return the text shown on the display, using the characters of the I2c7SegmentLed font
+    # ('?' for segment patterns that are not in the font)
+    def text(self, digits=None):
+        if digits is None:
+            digits = self.registers[I2c7SegmentLed.REG_SCAN_LIMIT] + 1
+        text = ""
+        for segments in self.segments(digits):
+            pattern = segments & ~I2c7SegmentLed.DECIMAL_POINT_MASK
+            if pattern == 0:
+                text += " "
+            else:
+                text += _characters.get(pattern, "?")
+            if segments & I2c7SegmentLed.DECIMAL_POINT_MASK:
+                text += "."
+        return text
+
+
+# i2c bus backend with simulated AS1115 chips
+class SimulatedI2cBus(I2cBus):
+
+    MAX_MESSAGES = 42       # same limit as the kernel's I2C_RDWR transactions
+
+    # latency is the delay added to every transaction and byteTime the delay added for every byte
+    # (in seconds). With realTime False the delays are only added up in busyTime instead of sleeping.
+    def __init__(self, latency=0.0, byteTime=0.0, realTime=True, seed=None):
+        I2cBus.__init__(self)
+        self.latency = latency
+        self.byteTime = byteTime
+        self.realTime = realTime
+        self.failRate = 0.0             # chance that a transaction fails (0.0 - 1.0)
+        self.failAddresses = set()      # addresses whose transactions always fail
+        self._failCount = 0
+        self._random = random.Random(seed)
+        self._devices = []
+        self.resetCounters()
+
+    # clear the transaction counters
+    def resetCounters(self):
+        self.transactions = 0           # number of bus transactions (syscalls)
+        self.messages = 0               # number of i2c messages (one per register write or read)
+        self.bytesWritten = 0
+        self.bytesRead = 0
+        self.errors = 0
+        self.busyTime = 0.0             # total simulated bus time in seconds
+
+    # add a simulated AS1115 chip with its jumpered address, returns the chip
+    def addDevice(self, userAddress):
+        device = SimulatedAS1115(userAddress)
+        self._devices.append(device)
+        return device
+
+    # return the chip answering at address (user address, or factory address before self addressing)
+    def device(self, address):
+        for device in self._devices:
+            if device.userAddress == address:
+                return device
+        return None
+
+    # make the next count transactions fail
+    def failNext(self, count=1):
+        self._failCount = count
+
+    def _delay(self, byteCount):
+        delay = self.latency + self.byteTime * byteCount
+        self.busyTime += delay
+        if self.realTime and delay > 0:
+            time.sleep(delay)
+
+    # return True if this transaction should fail because of the injected faults
+    def _injectedFault(self, address):
+        if address in self.failAddresses:
+            return True
+        if self._failCount > 0:
+            self._failCount -= 1
+            return True
+        return self.failRate > 0 and self._random.random() < self.failRate
+
+    # the connected chips answering at address
+    def _targets(self, address):
+        return [device for device in self._devices if device.connected and device.address == address]
+
+    # deliver one register write, raising IOError if no chip acknowledges it
+    def _write(self, address, reg, value):
+        self.messages += 1
+        self.bytesWritten += 2
+        targets = self._targets(address)
+        if not targets or self._injectedFault(address):
+            self.errors += 1
+            raise IOError(errno.EREMOTEIO, "no acknowledge from i2c address 0x%02x" %address)
+        for device in targets:          # all unaddressed chips answer at the factory address
+            device.write(reg, value)
+
+    def write_byte_data(self, address, reg, value):
+        with self.lock:
+            self.transactions += 1
+            self._delay(2)
+            self._write(address, reg, value)
+
+    # deliver one register read, raising IOError if no chip acknowledges it
+    def _read(self, address, reg):
+        self.messages += 2
+        self.bytesWritten += 1
+        self.bytesRead += 1
+        targets = self._targets(address)
+        if not targets or self._injectedFault(address):
+            self.errors += 1
+            raise IOError(errno.EREMOTEIO, "no acknowledge from i2c address 0x%02x" %address)
+        return targets[0].read(reg)
+
+    def read_byte_data(self, address, reg):
+        with self.lock:
+            self.transactions += 1
+            self._delay(2)
+            return self._read(address, reg)
+
+    # send the writes as combined transactions of up to MAX_MESSAGES messages. Like a real
+    # I2C_RDWR transaction, a transaction stops at the first message that is not acknowledged.
+    def writeBatch(self, writes):
+        failed = []
+        with self.lock:
+            for start in range(0, len(writes), SimulatedI2cBus.MAX_MESSAGES):
+                group = writes[start:start+SimulatedI2cBus.MAX_MESSAGES]
+                self.transactions += 1
+                self._delay(2 * len(group))
+                for index, (address, reg, value) in enumerate(group):
+                    try:
+                        self._write(address, reg, value)
+                    except IOError:
+                        failed.extend(group[index:])
+                        break
+        return failed
+
+    # read the registers with combined transactions of up to MAX_MESSAGES / 2 reads. When a read is
+    # not acknowledged the rest of its transaction is read again one register at a time.
+    def readBatch(self, reads):
+        values = []
+        perTransaction = SimulatedI2cBus.MAX_MESSAGES // 2
+        with self.lock:
+            for start in range(0, len(reads), perTransaction):
+                group = reads[start:start+perTransaction]
+                self.transactions += 1
+                self._delay(2 * len(group))
+                for index, (address, reg) in enumerate(group):
+                    try:
+                        values.append(self._read(address, reg))
+                    except IOError:
+                        values.append(None)
+                        values.extend(I2cBus.readBatch(self, group[index+1:]))
+                        break
+        return values
@@ -1,5 +1,11 @@
+import sys
+
 from setuptools import setup
 
+modules = ['I2c7SegmentLed', 'I2c7SegmentLedSim', 'I2c7SegmentLedDaemon']
+if sys.version_info >= (3, 5):
+    modules.append('I2c7SegmentLedAsync')   # uses async def, so it is left out of older installs
+
 setup(
     name='I2c7SegmentLed',
     version='1.0.1',
@@ -23,6 +29,7 @@ setup(
         'Programming Language :: Python :: 3.6',
     ],
     keywords='RPi AMS AS1115 I2C interface LED Seven Segment',
-    py_modules=['I2c7SegmentLed'],
-    install_requires=['smbus'],    
+    py_modules=modules,
+    install_requires=['smbus2'],             # preferred i2c library (also does combined I2C_RDWR transactions)
+    extras_require={'smbus': ['smbus']},     # the original smbus library, used if smbus2 isn't installed
 )
\ No newline at end of file
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+'''
+    test_I2c7SegmentLed.py - tests for the I2c7SegmentLed library, run on the simulated
+    AS1115 chips in I2c7SegmentLedSim.py
+
+    Usage:
+
+        python -m unittest test_I2c7SegmentLed
+        python -m pytest test_I2c7SegmentLed.py
+
+
+    License Information:  https://www.dcity.org/license-information/
+
+'''
+
+import unittest
+
+from I2c7SegmentLed import I2c7SegmentLed, BrightnessFade
+from I2c7SegmentLedSim import SimulatedI2cBus
+
+
+class BrightnessFadeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.bus = SimulatedI2cBus()
+        self.device = self.bus.addDevice(0x01)
+        self.led = I2c7SegmentLed(0x01, 4, self.bus)
+
+    # a late step skips frames, but the register changes of the skipped frames must still be written
+    def testLateStepKeepsSkippedWrites(self):
+        fade = BrightnessFade(self.led, [0, 0], [15, 2], 1.0, digits=[1, 3])
+        fade.start(0.0)
+        fade.step(0.0)
+        fade.step(0.55)
+        fade.step(2.0)
+        self.assertIsNone(fade.due())
+        self.assertEqual(self.led._digitBrightness[1], 15)
+        self.assertEqual(self.led._digitBrightness[3], 2)
+        self.assertEqual(self.device.registers[I2c7SegmentLed.REG_DIGIT01_INTENSITY] & 0x0f, 15)
+        self.assertEqual(self.device.registers[I2c7SegmentLed.REG_DIGIT23_INTENSITY] & 0x0f, 2)
+
+    # a fade that is never late ends at the same brightness
+    def testOnTimeSteps(self):
+        fade = BrightnessFade(self.led, [0, 0], [15, 2], 1.0, digits=[1, 3])
+        fade.start(0.0)
+        while fade.due() is not None:
+            fade.step(fade.due())
+        self.assertEqual(self.device.registers[I2c7SegmentLed.REG_DIGIT01_INTENSITY] & 0x0f, 15)
+        self.assertEqual(self.device.registers[I2c7SegmentLed.REG_DIGIT23_INTENSITY] & 0x0f, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()